@@ -1,11 +1,13 @@
 import bpy
-import json
-import os
+import uuid
 import bpy.app.handlers
 
-from bpy.app.handlers import persistent
-from .client import PlasticityClient
-from .handler import SceneHandler
+from .shared import (PRESET_FIELDS, flush_presets, forget_list_index, handler, live_refacet, load_presets,
+                     plasticity_client, refacet_prefetcher, schedule_save_presets, triangle_budget,
+                     update_and_save_preset, update_facet_setting, update_name)
+from . import lod
+from . import operators
+from . import ui
 
 bl_info = {
     "name": "Plasticity",
@@ -17,53 +19,6 @@ bl_info = {
     "category": "Object",
 }
 
-handler = SceneHandler()
-plasticity_client = PlasticityClient(handler)
-
-addon_name = bl_info["name"].replace(" ", "_")  
-
-base_path = bpy.utils.script_path_user()
-presets_folder = os.path.join(base_path, 'presets', addon_name)
-
-if not os.path.exists(presets_folder):
-    os.makedirs(presets_folder)
-
-PRESET_FILE_PATH = os.path.join(presets_folder, 'refacet_presets.json')
-
-# Save Refacet presets
-def save_presets():
-    presets = []
-    for preset in bpy.context.scene.refacet_presets:        
-        preset_dict = preset.to_dict()        
-        presets.append(preset_dict)
-            
-    with open(PRESET_FILE_PATH, 'w') as f:
-        json.dump(presets, f)           
-
-# Load refacet presets
-@persistent
-def load_presets(dummy):
-    scene = bpy.context.scene
-
-    # Clear existing presets
-    scene.refacet_presets.clear()
-    
-    if scene is None or not os.path.exists(PRESET_FILE_PATH):        
-        return
-    with open(PRESET_FILE_PATH, 'r') as f:
-        presets = json.load(f)    
-    
-    for preset_dict in presets:
-        preset = scene.refacet_presets.add()
-        preset.from_dict(preset_dict)            
-
-def update_and_save_preset(self, context):
-    save_presets()
-    
-def update_name(self, context):
-    print("Name updated.")
-    save_presets()    
-
 # Custom UIList to catch the event of renaming a member of the list. Looks like it's not natively supported by the API (necessary in order to save the Refacet presets whenever an entry is renamed by double clicking on an entry and renaming it).
 class OBJECT_UL_RefacetPresetsList(bpy.types.UIList):
     def draw_item(self, context, layout, data, item, icon, active_data, active_propname, index):
@@ -75,6 +30,8 @@ class OBJECT_UL_RefacetPresetsList(bpy.types.UIList):
 
 # Refacet Preset Class    
 class RefacetPreset(bpy.types.PropertyGroup):              
+    # NOTE: what objects and collections are assigned by; unlike the name it survives renames
+    key: bpy.props.StringProperty(name="Key")
     name: bpy.props.StringProperty(name="Name", default="New Preset", update=update_name)
     
     # Basic settings
@@ -90,23 +47,30 @@ class RefacetPreset(bpy.types.PropertyGroup):
     Face_Angle_tolerance: bpy.props.FloatProperty(name="Face Angle tolerance", default=0.45, min=0.1, max=1.0, update=update_and_save_preset)     
 
     def to_dict(self):
-        return {attr: getattr(self, attr) for attr in dir(self) 
-                if not callable(getattr(self, attr)) 
-                and not attr.startswith("__") 
-                and isinstance(getattr(self, attr), (int, float, str))}
+        return {field: getattr(self, field) for field in PRESET_FIELDS}
 
     def from_dict(self, preset_dict):
-        for attr, value in preset_dict.items():
-            setattr(self, attr, value)                 
+        for field in PRESET_FIELDS:
+            if field in preset_dict:
+                setattr(self, field, preset_dict[field])
 
 class AddRefacetPresetOperator(bpy.types.Operator):
     bl_idname = "refacet_preset.add"
     bl_label = "Add Refacet Preset"
     
     def execute(self, context):
-        preset = context.scene.refacet_presets.add()
-        preset.name = "New Preset"
-        save_presets()
+        presets = context.scene.refacet_presets
+        names = set(preset.name for preset in presets)
+        name = "New Preset"
+        suffix = 1
+        while name in names:
+            suffix += 1
+            name = "New Preset {}".format(suffix)
+
+        preset = presets.add()
+        preset.key = uuid.uuid4().hex
+        preset.name = name
+        schedule_save_presets()
         return {'FINISHED'}
 
 class RemoveRefacetPresetOperator(bpy.types.Operator):
@@ -116,7 +80,7 @@ class RemoveRefacetPresetOperator(bpy.types.Operator):
     def execute(self, context):
         index = context.scene.active_refacet_preset_index
         context.scene.refacet_presets.remove(index)
-        save_presets()
+        schedule_save_presets()
 
         if len(context.scene.refacet_presets) > 0:
             context.scene.active_refacet_preset_index = min(max(0, index - 1), len(context.scene.refacet_presets) - 1)
@@ -137,6 +101,11 @@ def register():
     bpy.utils.register_class(ui.SubscribeAllButton)
     bpy.utils.register_class(ui.UnsubscribeAllButton)
     bpy.utils.register_class(ui.RefacetButton)
+    bpy.utils.register_class(ui.RefacetToBudgetButton)
+    bpy.utils.register_class(ui.RefacetAllButton)
+    bpy.utils.register_class(ui.AssignRefacetPresetButton)
+    bpy.utils.register_class(ui.UndoCheckpointButton)
+    bpy.utils.register_class(ui.LoadHiddenButton)
 
     bpy.utils.register_class(RefacetPreset)
     bpy.types.Scene.refacet_presets = bpy.props.CollectionProperty(type=RefacetPreset)
@@ -159,8 +128,8 @@ def register():
     bpy.types.VIEW3D_MT_edit_mesh_select_similar.append(select_similar)
 
     bpy.types.Scene.prop_plasticity_server = bpy.props.StringProperty(name="Server", default="localhost:8980")
-    bpy.types.Scene.prop_plasticity_facet_tolerance = bpy.props.FloatProperty(name="Tolerance", default=0.01, min=0.0001, max=0.1, step=0.001, precision=6)
-    bpy.types.Scene.prop_plasticity_facet_angle = bpy.props.FloatProperty(name="Angle", default=0.45, min=0.1, max=1.0)
+    bpy.types.Scene.prop_plasticity_facet_tolerance = bpy.props.FloatProperty(name="Tolerance", default=0.01, min=0.0001, max=0.1, step=0.001, precision=6, update=update_facet_setting)
+    bpy.types.Scene.prop_plasticity_facet_angle = bpy.props.FloatProperty(name="Angle", default=0.45, min=0.1, max=1.0, update=update_facet_setting)
     bpy.types.Scene.prop_plasticity_list_only_visible = bpy.props.BoolProperty(name="List only visible", default=False)
     bpy.types.Scene.prop_plasticity_facet_tri_or_ngon = bpy.props.EnumProperty(
         items=[
@@ -169,26 +138,60 @@ def register():
         ],
         name="Facet Type",
         default="TRI",
+        update=update_facet_setting,
     )
     bpy.types.Scene.prop_plasticity_ui_show_advanced_facet = bpy.props.BoolProperty(name="Advanced", default=False)
-    bpy.types.Scene.prop_plasticity_facet_min_width = bpy.props.FloatProperty(name="Min Width", default=0.0, min=0, max=10, unit="LENGTH")
-    bpy.types.Scene.prop_plasticity_facet_max_width = bpy.props.FloatProperty(name="Max Width", default=0.0, min=0.0001, max=1000.0, step=0.01, soft_min=0.02, precision=6, unit="LENGTH")
+    bpy.types.Scene.prop_plasticity_facet_min_width = bpy.props.FloatProperty(name="Min Width", default=0.0, min=0, max=10, unit="LENGTH", update=update_facet_setting)
+    bpy.types.Scene.prop_plasticity_facet_max_width = bpy.props.FloatProperty(name="Max Width", default=0.0, min=0.0001, max=1000.0, step=0.01, soft_min=0.02, precision=6, unit="LENGTH", update=update_facet_setting)
     bpy.types.Scene.prop_plasticity_unit_scale = bpy.props.FloatProperty(name="Unit Scale", default=1.0, min=0.0001, max=1000.0)
-    bpy.types.Scene.prop_plasticity_curve_chord_tolerance = bpy.props.FloatProperty(name="Edge chord tolerance", default=0.01, min=0.0001, step=0.01, max=1.0, precision=6)
-    bpy.types.Scene.prop_plasticity_curve_angle_tolerance = bpy.props.FloatProperty(name="Edge Angle tolerance", default=0.45, min=0.1, max=1.0)
-    bpy.types.Scene.prop_plasticity_surface_plane_tolerance = bpy.props.FloatProperty(name="Face plane tolerance", default=0.01, min=0.0001, step=0.01, max=1.0, precision=6)
-    bpy.types.Scene.prop_plasticity_surface_angle_tolerance = bpy.props.FloatProperty(name="Face Angle tolerance", default=0.45, min=0.1, max=1.0)
+    bpy.types.Scene.prop_plasticity_curve_chord_tolerance = bpy.props.FloatProperty(name="Edge chord tolerance", default=0.01, min=0.0001, step=0.01, max=1.0, precision=6, update=update_facet_setting)
+    bpy.types.Scene.prop_plasticity_curve_angle_tolerance = bpy.props.FloatProperty(name="Edge Angle tolerance", default=0.45, min=0.1, max=1.0, update=update_facet_setting)
+    bpy.types.Scene.prop_plasticity_surface_plane_tolerance = bpy.props.FloatProperty(name="Face plane tolerance", default=0.01, min=0.0001, step=0.01, max=1.0, precision=6, update=update_facet_setting)
+    bpy.types.Scene.prop_plasticity_surface_angle_tolerance = bpy.props.FloatProperty(name="Face Angle tolerance", default=0.45, min=0.1, max=1.0, update=update_facet_setting)
     bpy.types.Scene.mark_seam = bpy.props.BoolProperty(name="Mark Seam")
     bpy.types.Scene.mark_sharp = bpy.props.BoolProperty(name="Mark Sharp") 
+    bpy.types.Scene.prop_plasticity_undo_policy = bpy.props.EnumProperty(
+        items=[
+            ("TRANSACTION", "Per update", "One undo step per live-link transaction"),
+            ("WINDOW", "Time window", "Coalesce live-link updates into one undo step per time window"),
+            ("NONE", "Checkpoints", "No undo steps for live-link updates; use Checkpoint to record one"),
+        ],
+        name="Undo",
+        default="TRANSACTION",
+    )
+    bpy.types.Scene.prop_plasticity_undo_window = bpy.props.FloatProperty(name="Undo Window", default=2.0, min=0.1, max=60.0, unit="TIME_ABSOLUTE")
+    bpy.types.Scene.prop_plasticity_livelink_throttle = bpy.props.BoolProperty(name="Throttle", description="Limit how often live-link updates are applied, based on how long they take", default=True)
+    bpy.types.Scene.prop_plasticity_livelink_max_rate = bpy.props.FloatProperty(name="Max Rate", description="Maximum live-link updates applied per second", default=10.0, min=0.5, max=60.0)
+    bpy.types.Scene.prop_plasticity_pull_on_save = bpy.props.BoolProperty(name="Pull on save", description="Refresh automatically when Plasticity saves a new version, without the live link", default=False)
+    bpy.types.Scene.prop_plasticity_pull_paused = bpy.props.BoolProperty(name="Paused", description="Hold automatic refreshes until unpaused", default=False)
+    bpy.types.Scene.prop_plasticity_pull_min_interval = bpy.props.FloatProperty(name="Min Interval", description="Minimum time between automatic refreshes", default=2.0, min=0.0, max=600.0, unit="TIME_ABSOLUTE")
+    bpy.types.Scene.prop_plasticity_defer_hidden = bpy.props.BoolProperty(name="Defer hidden", description="Don't build meshes for hidden objects until they become visible or are loaded explicitly", default=False)
+    bpy.types.Scene.prop_plasticity_defer_to_disk = bpy.props.BoolProperty(name="Keep on disk", description="Store the geometry of deferred objects in temporary files instead of memory", default=False)
+    bpy.types.Scene.prop_plasticity_triangle_budget = bpy.props.IntProperty(name="Triangle Budget", description="Total triangles the selection (or the active collection) should be refaceted to", default=100000, min=100)
+    bpy.types.Scene.prop_plasticity_budget_tolerance = bpy.props.FloatProperty(name="Budget Tolerance", description="How far from the budget the total may end up", default=0.05, min=0.01, max=0.5, subtype='FACTOR')
+    bpy.types.Scene.prop_plasticity_live_refacet = bpy.props.BoolProperty(name="Live", description="Refacet the selection while facet settings are being changed", default=False)
+    bpy.types.Scene.prop_plasticity_refacet_prefetch = bpy.props.BoolProperty(name="Prefetch", description="Refacet selected objects in the background so that Refacet applies instantly", default=False)
+    bpy.types.Scene.prop_plasticity_refacet_progressive = bpy.props.BoolProperty(name="Progressive", description="Show a quick coarse refacet first and replace it once the requested one arrives", default=False)
+    bpy.types.Scene.prop_plasticity_lod_mode = bpy.props.BoolProperty(name="LOD", description="Refacet into several levels of detail: coarse ones for the viewport, the finest for rendering", default=False)
+    bpy.types.Scene.prop_plasticity_lod_levels = bpy.props.IntProperty(name="Levels", default=2, min=2, max=3)
+    bpy.types.Scene.prop_plasticity_refacet_cache_size = bpy.props.IntProperty(name="Refacet Cache", description="Memory for keeping received refacets, so that switching back to a previous preset is instant (MB, 0 disables)", default=256, min=0, max=16384)
+    bpy.types.Scene.prop_plasticity_lod_distance = bpy.props.FloatProperty(name="Switch Distance", description="Viewport distance after which the next coarser level is shown", default=10.0, min=0.01, unit="LENGTH")
         
     bpy.utils.register_class(OBJECT_UL_RefacetPresetsList)  
 
     bpy.app.handlers.load_post.append(load_presets)    
+    bpy.app.handlers.load_post.append(forget_list_index)
+    bpy.app.handlers.undo_post.append(forget_list_index)
+    bpy.app.handlers.redo_post.append(forget_list_index)
+    lod.register()
+    refacet_prefetcher.register()
     
     print("Plasticity client registered")
 
 def unregister():
     print("Unregistering Plasticity client")
+    # NOTE: before the preset properties go away
+    flush_presets()
 
     bpy.utils.unregister_class(ui.PlasticityPanel)
     bpy.utils.unregister_class(ui.DisconnectButton)
@@ -197,6 +200,11 @@ def unregister():
     bpy.utils.unregister_class(ui.SubscribeAllButton)
     bpy.utils.unregister_class(ui.UnsubscribeAllButton)
     bpy.utils.unregister_class(ui.RefacetButton)
+    bpy.utils.unregister_class(ui.RefacetToBudgetButton)
+    bpy.utils.unregister_class(ui.RefacetAllButton)
+    bpy.utils.unregister_class(ui.AssignRefacetPresetButton)
+    bpy.utils.unregister_class(ui.UndoCheckpointButton)
+    bpy.utils.unregister_class(ui.LoadHiddenButton)
     
     bpy.utils.unregister_class(RefacetPreset)
     bpy.utils.unregister_class(AddRefacetPresetOperator)
@@ -220,6 +228,18 @@ def unregister():
     bpy.utils.unregister_class(OBJECT_UL_RefacetPresetsList)    
     
     bpy.app.handlers.load_post.remove(load_presets)
+    bpy.app.handlers.load_post.remove(forget_list_index)
+    bpy.app.handlers.undo_post.remove(forget_list_index)
+    bpy.app.handlers.redo_post.remove(forget_list_index)
+    refacet_prefetcher.unregister()
+    lod.unregister()
+
+    handler.undo.cancel()
+    handler.deferred.clear()
+    triangle_budget.cancel()
+    live_refacet.cancel()
+    plasticity_client.governor.cancel()
+    plasticity_client.puller.cancel()
 
     del bpy.types.Scene.prop_plasticity_server
     del bpy.types.Scene.prop_plasticity_facet_tolerance
@@ -233,6 +253,24 @@ def unregister():
     del bpy.types.Scene.prop_plasticity_surface_angle_tolerance
     del bpy.types.Scene.mark_seam
     del bpy.types.Scene.mark_sharp             
+    del bpy.types.Scene.prop_plasticity_undo_policy
+    del bpy.types.Scene.prop_plasticity_undo_window
+    del bpy.types.Scene.prop_plasticity_livelink_throttle
+    del bpy.types.Scene.prop_plasticity_livelink_max_rate
+    del bpy.types.Scene.prop_plasticity_pull_on_save
+    del bpy.types.Scene.prop_plasticity_pull_paused
+    del bpy.types.Scene.prop_plasticity_pull_min_interval
+    del bpy.types.Scene.prop_plasticity_defer_hidden
+    del bpy.types.Scene.prop_plasticity_defer_to_disk
+    del bpy.types.Scene.prop_plasticity_refacet_progressive
+    del bpy.types.Scene.prop_plasticity_refacet_prefetch
+    del bpy.types.Scene.prop_plasticity_live_refacet
+    del bpy.types.Scene.prop_plasticity_triangle_budget
+    del bpy.types.Scene.prop_plasticity_budget_tolerance
+    del bpy.types.Scene.prop_plasticity_lod_mode
+    del bpy.types.Scene.prop_plasticity_lod_levels
+    del bpy.types.Scene.prop_plasticity_lod_distance
+    del bpy.types.Scene.prop_plasticity_refacet_cache_size
 
 if __name__ == "__main__":
     register()
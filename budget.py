@@ -0,0 +1,161 @@
+import math
+import time
+
+import bpy
+import numpy as np
+
+from .refacet import coarsened, facet_params_from_scene, plasticity_objects_by_filename
+
+MAX_ITERATIONS = 5
+POLL_INTERVAL = 0.1
+# NOTE: give up on an iteration whose refacets haven't all come back by then
+ITERATION_TIMEOUT = 60.0
+# NOTE: factors are rounded to quarter powers of two, so objects share requests
+FACTOR_STEPS_PER_OCTAVE = 4
+MIN_FACTOR = 1.0 / 64
+MAX_FACTOR = 64.0
+# NOTE: objects much smaller than the largest one are faceted up to this much coarser
+MAX_SIZE_RATIO = 16.0
+
+
+def triangle_count(mesh):
+    loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    return int(np.sum(loop_total - 2))
+
+
+def quantized(factor):
+    factor = min(max(factor, MIN_FACTOR), MAX_FACTOR)
+    return 2 ** (round(math.log2(factor) * FACTOR_STEPS_PER_OCTAVE) / FACTOR_STEPS_PER_OCTAVE)
+
+
+class TriangleBudget:
+    """Refacets a set of objects so that together they come out at a target triangle count.
+
+    Each object gets a factor on the scene's facet tolerances. Its triangle count is modelled as k / factor, where k
+    comes from the last refacet of the object (its triangle count times the factor used) and is re-measured after
+    every iteration. Smaller objects get proportionally coarser factors. Objects that end up with the same factor are
+    refaceted in one request. Iterations stop once the total is within tolerance of the budget.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.objects = []
+        self.budget = 0
+        self.tolerance = 0.05
+        self.params = None
+        self.iteration = 0
+        self.waiting = {}
+        self.started = 0.0
+        self.status = ""
+        self.running = False
+        self.timer_registered = False
+        self.timer = self.__on_timer
+
+    def start(self, context, objects, budget, tolerance):
+        self.objects = [obj for obj in objects if obj.type == 'MESH' and "plasticity_id" in obj]
+        if len(self.objects) == 0 or budget <= 0:
+            return False
+        self.budget = budget
+        self.tolerance = tolerance
+        self.iteration = 0
+        self.params = facet_params_from_scene(context.scene)
+        self.__refacet()
+        self.running = True
+        if not self.timer_registered:
+            self.timer_registered = True
+            bpy.app.timers.register(self.timer, first_interval=POLL_INTERVAL, persistent=True)
+        return True
+
+    def cancel(self):
+        self.waiting = {}
+        self.running = False
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.timer_registered = False
+
+    def __factors(self):
+        sizes = np.array([max(obj.dimensions.length, 1e-9) for obj in self.objects])
+        # NOTE: relative to the largest object; with relative_to_bbox the same factor gives a similar count at any size
+        weights = np.minimum(sizes.max() / sizes, MAX_SIZE_RATIO)
+
+        factors = np.array([obj.get("plasticity_budget_factor", 1.0) for obj in self.objects])
+        triangles = np.array([triangle_count(obj.data) for obj in self.objects], dtype=np.float64)
+        k = triangles * factors
+        if np.any(k <= 0):
+            # NOTE: no measurement yet (e.g. an empty mesh); assume an average object
+            k[k <= 0] = k[k > 0].mean() if np.any(k > 0) else 1.0
+
+        # NOTE: solve sum(k / (scale * weight)) = budget for the global scale
+        scale = np.sum(k / weights) / self.budget
+        return [quantized(scale * weight) for weight in weights]
+
+    def __refacet(self):
+        self.iteration += 1
+        factors = self.__factors()
+
+        batches = {}
+        for obj, factor in zip(self.objects, factors):
+            obj["plasticity_budget_factor"] = factor
+            batches.setdefault(factor, []).append(obj)
+
+        self.waiting = {}
+        for factor, objects in batches.items():
+            params = coarsened(self.params, factor)
+            for filename, file_objects in plasticity_objects_by_filename(objects).items():
+                plasticity_ids = [obj["plasticity_id"] for obj in file_objects]
+                generation = self.client.refacet_some(filename,
+                                                      plasticity_ids,
+                                                      **params._asdict(),
+                                                      versions=[obj.get("plasticity_version") for obj in file_objects])
+                for plasticity_id in plasticity_ids:
+                    self.waiting[(filename, plasticity_id, None)] = generation
+        self.started = time.monotonic()
+        self.status = "Refaceting to budget, pass {}".format(self.iteration)
+
+    def __on_timer(self):
+        result = self.__step() if self.running else None
+        if result is None:
+            self.running = False
+            self.timer_registered = False
+        return result
+
+    def __step(self):
+        client = self.client
+        if not client.connected:
+            self.status = "Budget refacet stopped: disconnected"
+            return None
+
+        pending = [key for key, generation in self.waiting.items()
+                   if client.refacet_applied.get(key) != generation]
+        if pending:
+            superseded = any(client.refacet_latest.get(key[:2], {}).get(None) != self.waiting[key] for key in pending)
+            if superseded:
+                self.status = "Budget refacet stopped: superseded by another refacet"
+                return None
+            if time.monotonic() - self.started > ITERATION_TIMEOUT:
+                self.status = "Budget refacet stopped: {} objects didn't come back".format(len(pending))
+                return None
+            return POLL_INTERVAL
+
+        try:
+            total = sum(triangle_count(obj.data) for obj in self.objects)
+        except ReferenceError:
+            self.status = "Budget refacet stopped: objects were removed"
+            return None
+
+        if abs(total - self.budget) <= self.tolerance * self.budget:
+            self.status = "{} triangles, within budget after {} passes".format(total, self.iteration)
+            return None
+        if self.iteration >= MAX_ITERATIONS:
+            self.status = "{} triangles after {} passes (budget {})".format(total, self.iteration, self.budget)
+            return None
+
+        previous = [obj.get("plasticity_budget_factor") for obj in self.objects]
+        if self.__factors() == previous:
+            # NOTE: rounding keeps every factor where it is, so another pass wouldn't change anything
+            self.status = "{} triangles, closest reachable to {}".format(total, self.budget)
+            return None
+
+        self.__refacet()
+        return POLL_INTERVAL
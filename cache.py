@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_REFACET_CACHE_BYTES = 256 * 2 ** 20
+
+
+class RefacetCache:
+    """Bounded LRU of decoded refacet results.
+
+    Keys are (filename, plasticity_id, object version, facet parameter tuple), so a hit is exactly the tessellation
+    Plasticity would send back for the same request. Entries are copied out of the message buffer, so the cache only
+    holds the bytes it accounts for.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_REFACET_CACHE_BYTES):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        # NOTE: doesn't count as a hit or miss, nor refresh the entry
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, arrays):
+        entry = tuple(np.array(array) for array in arrays)
+        size = sum(array.nbytes for array in entry)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= sum(array.nbytes for array in previous)
+            self.entries[key] = entry
+            self.nbytes += size
+            self.__evict()
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def __evict(self):
+        while self.nbytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.nbytes -= sum(array.nbytes for array in entry)
@@ -1,18 +1,31 @@
 import asyncio
 import struct
 import threading
+import time
 import weakref
 from asyncio import run_coroutine_threadsafe
+from collections import deque
 from enum import Enum
 
 import bpy
 import numpy as np
 
+from . import prepare
+from .cache import RefacetCache
+from .governor import LiveLinkGovernor
+from .pull import PullOnSave
 from .libs.websockets import client
 from .libs.websockets.exceptions import (ConnectionClosed, InvalidURI,
                                          WebSocketException)
 
 max_size = 2 ** 32 - 1
+PREPARE_POLL_INTERVAL = 0.005
+# NOTE: large refacets are split into requests of at most this many objects, with a bounded number in flight, so
+# results stream back and are applied chunk by chunk instead of in one huge message
+REFACET_CHUNK_SIZE = 16
+MAX_REFACETS_IN_FLIGHT = 4
+# NOTE: a refacet request without a reply after this long frees its slot, so a lost reply can't stall the pipeline
+REFACET_TIMEOUT = 60.0
 
 
 class MessageType(Enum):
@@ -54,22 +67,44 @@ class PlasticityClient:
         self.server = None
         self.connected = False
         self.subscribed = False
-        self.filename = None
+        # NOTE: every Plasticity file heard from this session, in the order they first appeared
+        self.filenames = []
         self.websocket = None
         self.message_id = 0
+        # NOTE: message_id -> what an in-flight REFACET_SOME_1 request was for
+        self.refacet_requests = {}
+        # NOTE: message_id -> requests given up on; a late reply is still checked against its generation
+        self.refacet_expired = {}
+        self.refacet_cache = RefacetCache()
+        # NOTE: (filename, plasticity_id) -> lod -> generation of the newest refacet asked for; anything older is stale
+        self.refacet_latest = {}
+        self.refacet_generation = 0
+        # NOTE: (filename, plasticity_id, lod) -> generation whose final (non-preview) result has been applied
+        self.refacet_applied = {}
+        self.refacet_superseded = 0
+        # NOTE: refacet requests waiting to be sent; superseded ones are dropped before they go out
+        self.refacet_outbox = deque()
+        # NOTE: speculative refacets that only fill the refacet cache; sent when nothing the user asked for is waiting
+        self.prefetch_outbox = deque()
+        # NOTE: message_id -> {(filename, plasticity_id): version} Blender had when a pull-on-save list request was sent
+        self.pull_requests = {}
         self.handler = handler
+        self.governor = LiveLinkGovernor(handler)
+        self.puller = PullOnSave(self)
         self.loop = asyncio.new_event_loop()
 
-    def list_all(self):
+    def list_all(self, known_versions=None):
         if self.connected:
             self.report({'INFO'}, "Refreshing available meshes...")
 
             future = run_coroutine_threadsafe(
-                self.list_all_async(), self.loop)
+                self.list_all_async(known_versions), self.loop)
             future.result()
 
-    async def list_all_async(self):
+    async def list_all_async(self, known_versions=None):
         self.message_id += 1
+        if known_versions is not None:
+            self.pull_requests[self.message_id] = known_versions
 
         get_objects_message = struct.pack(
             "<I", MessageType.LIST_ALL_1.value)
@@ -77,16 +112,18 @@ class PlasticityClient:
             "<I", self.message_id)
         await self.websocket.send(get_objects_message)
 
-    def list_visible(self):
+    def list_visible(self, known_versions=None):
         if self.connected:
             self.report({'INFO'}, "Refreshing visible meshes...")
 
             future = run_coroutine_threadsafe(
-                self.list_visible_async(), self.loop)
+                self.list_visible_async(known_versions), self.loop)
             future.result()
 
-    async def list_visible_async(self):
+    async def list_visible_async(self, known_versions=None):
         self.message_id += 1
+        if known_versions is not None:
+            self.pull_requests[self.message_id] = known_versions
 
         get_objects_message = struct.pack(
             "<I", MessageType.LIST_VISIBLE_1.value)
@@ -94,6 +131,41 @@ class PlasticityClient:
             "<I", self.message_id)
         await self.websocket.send(get_objects_message)
 
+    def list_some(self, filename, plasticity_ids, known_versions=None):
+        if self.connected:
+            self.report({'INFO'}, "Refreshing meshes...")
+
+            future = run_coroutine_threadsafe(
+                self.list_some_async(filename, plasticity_ids, known_versions), self.loop)
+            future.result()
+
+    async def list_some_async(self, filename, plasticity_ids, known_versions=None):
+        if len(plasticity_ids) == 0:
+            return
+
+        self.message_id += 1
+        if known_versions is not None:
+            self.pull_requests[self.message_id] = known_versions
+
+        # NOTE: laid out like SUBSCRIBE_SOME_1 and REFACET_SOME_1: filename, then the ids
+        list_message = struct.pack(
+            "<I", MessageType.LIST_SOME_1.value)
+        list_message += struct.pack(
+            "<I", self.message_id)
+        list_message += struct.pack(
+            "<I", len(filename))
+        list_message += struct.pack(
+            f"<{len(filename)}s", filename.encode('utf-8'))
+        padding = (4 - (len(filename) % 4)) % 4
+        list_message += struct.pack(
+            f"<{padding}x")
+        list_message += struct.pack(
+            "<I", len(plasticity_ids))
+        for plasticity_id in plasticity_ids:
+            list_message += struct.pack(
+                "<I", plasticity_id)
+        await self.websocket.send(list_message)
+
     def subscribe_all(self):
         if self.connected:
             self.report({'INFO'}, "Subscribing to all meshes...")
@@ -162,24 +234,141 @@ class PlasticityClient:
                 "<I", plasticity_id)
         await self.websocket.send(subscribe_message)
 
-    def refacet_some(self, filename, plasticity_ids, relative_to_bbox=True, curve_chord_tolerance=0.01, curve_chord_angle=0.35, surface_plane_tolerance=0.01, surface_plane_angle=0.35, match_topology=True, max_sides=3, plane_angle=0, min_width=0, max_width=0, curve_chord_max=0, shape=FacetShapeType.CUT):
+    def refacet_some(self, filename, plasticity_ids, relative_to_bbox=True, curve_chord_tolerance=0.01, curve_chord_angle=0.35, surface_plane_tolerance=0.01, surface_plane_angle=0.35, match_topology=True, max_sides=3, plane_angle=0, min_width=0, max_width=0, curve_chord_max=0, shape=FacetShapeType.CUT, lod=None, versions=None, preview=None):
+        """Refacet objects, from the refacet cache where possible; preview, if given, is a coarser parameter tuple whose
+        result is applied first and replaced once the requested tessellation arrives."""
         if self.connected:
-            self.report({'INFO'}, "Refaceting meshes...")
+            self.refacet_generation += 1
+            generation = self.refacet_generation
+            self.__supersede_refacets(filename, plasticity_ids, lod, generation)
+
+            params = (relative_to_bbox, curve_chord_tolerance, curve_chord_angle, surface_plane_tolerance, surface_plane_angle,
+                      match_topology, max_sides, plane_angle, min_width, max_width, curve_chord_max, shape)
+            version_by_id = None
+            if versions is not None:
+                version_by_id = dict(zip(plasticity_ids, versions))
+                plasticity_ids = self.__apply_cached_refacets(
+                    filename, plasticity_ids, versions, params, lod, generation)
+                if len(plasticity_ids) == 0:
+                    return generation
 
-            future = run_coroutine_threadsafe(
-                self.refacet_some_async(filename, plasticity_ids, relative_to_bbox, curve_chord_tolerance, curve_chord_angle, surface_plane_tolerance, surface_plane_angle, match_topology, max_sides, plane_angle, min_width, max_width, curve_chord_max, shape), self.loop)
-            future.result()
+            self.report({'INFO'}, "Refaceting meshes...")
 
-    async def refacet_some_async(self, filename, plasticity_ids, relative_to_bbox=True, curve_chord_tolerance=0.01, curve_chord_angle=0.35, surface_plane_tolerance=0.01, surface_plane_angle=0.35, match_topology=True, max_sides=3, plane_angle=0, min_width=0, max_width=0, curve_chord_max=0, shape=FacetShapeType.CUT):
-        if len(plasticity_ids) == 0:
+            if preview is not None:
+                # NOTE: same generation as the final request; whichever arrives last, the preview never replaces it
+                preview_ids = plasticity_ids
+                if version_by_id is not None:
+                    preview_ids = self.__apply_cached_refacets(
+                        filename, preview_ids, [version_by_id[plasticity_id] for plasticity_id in preview_ids],
+                        tuple(preview), lod, generation, is_preview=True)
+                for chunk in chunked(preview_ids, REFACET_CHUNK_SIZE):
+                    self.refacet_outbox.append({"filename": filename, "plasticity_ids": chunk, "lod": lod,
+                                                "params": tuple(preview), "generation": generation, "preview": True})
+            for chunk in chunked(plasticity_ids, REFACET_CHUNK_SIZE):
+                self.refacet_outbox.append({"filename": filename, "plasticity_ids": chunk, "lod": lod,
+                                            "params": params, "generation": generation, "preview": False})
+            run_coroutine_threadsafe(self.flush_refacets_async(), self.loop)
+            return generation
+
+    async def flush_refacets_async(self):
+        # NOTE: the check and the registration in refacet_requests happen without an await in between, so concurrent
+        # flushes can't overshoot the limit
+        while True:
+            in_flight = len(self.refacets_in_flight())
+            if self.refacet_outbox and in_flight < MAX_REFACETS_IN_FLIGHT:
+                request = self.refacet_outbox.popleft()
+            elif self.prefetch_outbox and in_flight < MAX_REFACETS_IN_FLIGHT - 1:
+                # NOTE: prefetches never take the last slot, so a click on Refacet goes out right away
+                request = self.prefetch_outbox.popleft()
+                await self.refacet_some_async(request["filename"], request["plasticity_ids"], *request["params"],
+                                              is_prefetch=True)
+                continue
+            else:
+                break
+
+            filename = request["filename"]
+            plasticity_ids = [plasticity_id for plasticity_id in request["plasticity_ids"]
+                              if self.__is_latest_refacet(filename, plasticity_id, request["lod"], request["generation"])]
+            self.refacet_superseded += len(request["plasticity_ids"]) - len(plasticity_ids)
+            if len(plasticity_ids) == 0:
+                continue
+            await self.refacet_some_async(filename, plasticity_ids, *request["params"],
+                                          lod=request["lod"], generation=request["generation"],
+                                          is_preview=request["preview"])
+
+    def refacets_in_flight(self):
+        """The refacet requests still waiting for a reply; requests older than REFACET_TIMEOUT are given up on."""
+        now = time.monotonic()
+        expired = [message_id for message_id, request in list(self.refacet_requests.items())
+                   if now - request["sent"] > REFACET_TIMEOUT]
+        for message_id in expired:
+            request = self.refacet_requests.pop(message_id, None)
+            if request is not None:
+                self.refacet_expired[message_id] = request
+        if expired:
+            self.report({'WARNING'}, f"No reply to {len(expired)} refacet requests, giving up on them")
+        return list(self.refacet_requests.values())
+
+    def __reset_refacets(self):
+        self.refacet_requests = {}
+        self.refacet_expired = {}
+        self.refacet_outbox.clear()
+        self.prefetch_outbox.clear()
+
+    def prefetch_refacets(self, filename, plasticity_ids, versions, params):
+        """Request refacets in the background so that a later refacet_some with the same params is a cache hit."""
+        if not self.connected:
             return
+        params = tuple(params)
+        in_flight = set()
+        for request in self.refacets_in_flight():
+            if request.get("prefetch") and request["filename"] == filename and request["params"] == params:
+                in_flight.update(request["plasticity_ids"])
+
+        missing = [plasticity_id for plasticity_id, version in zip(plasticity_ids, versions)
+                   if version is not None and plasticity_id not in in_flight
+                   and (filename, plasticity_id, version, params) not in self.refacet_cache]
+        for chunk in chunked(missing, REFACET_CHUNK_SIZE):
+            self.prefetch_outbox.append({"filename": filename, "plasticity_ids": chunk, "params": params})
+        if missing:
+            run_coroutine_threadsafe(self.flush_refacets_async(), self.loop)
+
+    def cancel_prefetch(self):
+        self.prefetch_outbox.clear()
+
+    def __supersede_refacets(self, filename, plasticity_ids, lod, generation):
+        for plasticity_id in plasticity_ids:
+            latest = self.refacet_latest.setdefault((filename, plasticity_id), {})
+            if lod is None:
+                # NOTE: a plain refacet replaces the mesh and drops its levels of detail, so it supersedes all of them
+                latest.clear()
+            else:
+                latest.pop(None, None)
+            latest[lod] = generation
+
+    def __is_latest_refacet(self, filename, plasticity_id, lod, generation):
+        if generation is None:
+            return True
+        return self.refacet_latest.get((filename, plasticity_id), {}).get(lod) == generation
+
+    async def refacet_some_async(self, filename, plasticity_ids, relative_to_bbox=True, curve_chord_tolerance=0.01, curve_chord_angle=0.35, surface_plane_tolerance=0.01, surface_plane_angle=0.35, match_topology=True, max_sides=3, plane_angle=0, min_width=0, max_width=0, curve_chord_max=0, shape=FacetShapeType.CUT, lod=None, generation=None, is_preview=False, is_prefetch=False):
+        if len(plasticity_ids) == 0:
+            return None
 
         self.message_id += 1
+        message_id = self.message_id
+        params = (relative_to_bbox, curve_chord_tolerance, curve_chord_angle, surface_plane_tolerance, surface_plane_angle,
+                  match_topology, max_sides, plane_angle, min_width, max_width, curve_chord_max, shape)
+        self.refacet_requests[message_id] = {
+            "filename": filename, "plasticity_ids": list(plasticity_ids), "lod": lod, "params": params,
+            "generation": generation, "preview": is_preview, "prefetch": is_prefetch, "sent": time.monotonic()}
+        # NOTE: if no reply comes, the queue is flushed again once this request has expired
+        self.loop.call_later(REFACET_TIMEOUT + 1.0, lambda: self.loop.create_task(self.flush_refacets_async()))
 
         refacet_message = struct.pack(
             "<I", MessageType.REFACET_SOME_1.value)
         refacet_message += struct.pack(
-            "<I", self.message_id)
+            "<I", message_id)
         refacet_message += struct.pack(
             "<I", len(filename))
         refacet_message += struct.pack(
@@ -217,7 +406,58 @@ class PlasticityClient:
         refacet_message += struct.pack(
             "<I", shape.value)
 
-        await self.websocket.send(refacet_message)
+        try:
+            await self.websocket.send(refacet_message)
+        except Exception as e:
+            # NOTE: nothing awaits the flush that sent this, so say so here; the objects keep their current mesh
+            self.refacet_requests.pop(message_id, None)
+            self.report({'ERROR'}, f"Refacet of {len(plasticity_ids)} objects not sent, dropping it: {e}")
+            return None
+        return message_id
+
+    def __apply_cached_refacets(self, filename, plasticity_ids, versions, params, lod, generation=None, is_preview=False):
+        """Apply every refacet the cache already holds for these objects; returns the ids that still need a request."""
+        misses = []
+        hits = []
+        for plasticity_id, version in zip(plasticity_ids, versions):
+            entry = None
+            if version is not None:
+                entry = self.refacet_cache.get(
+                    (filename, plasticity_id, version, params))
+            if entry is None:
+                misses.append(plasticity_id)
+            else:
+                hits.append((plasticity_id, version, entry))
+
+        if len(hits) > 0:
+            self.report({'INFO'}, f"Applying {len(hits)} cached refacets")
+            faces, positions, indices, normals, groups, face_ids = (
+                list(arrays) for arrays in zip(*(entry for _, _, entry in hits)))
+            self.__schedule_refacet(filename, None, [plasticity_id for plasticity_id, _, _ in hits], [version for _, version, _ in hits],
+                                    faces, positions, indices, normals, groups, face_ids, lod, generation, is_preview)
+        return misses
+
+    def __schedule_refacet(self, filename, file_version, plasticity_ids, versions, faces, positions, indices, normals, groups, face_ids, lod, generation=None, is_preview=False):
+        prepared = [prepare.submit_ngons(face, position, index, normal, group, face_id)
+                    for face, position, index, normal, group, face_id in zip(faces, positions, indices, normals, groups, face_ids)]
+
+        def apply():
+            # NOTE: a newer refacet may have been requested while this one was being prepared
+            keep = [i for i, plasticity_id in enumerate(plasticity_ids)
+                    if self.__is_latest_refacet(filename, plasticity_id, lod, generation)
+                    and not (is_preview and self.refacet_applied.get((filename, plasticity_id, lod)) == generation)]
+            self.refacet_superseded += len(plasticity_ids) - len(keep)
+            if len(keep) == 0:
+                return
+
+            def pick(values):
+                return [values[i] for i in keep]
+            self.handler.on_refacet(filename, file_version, pick(plasticity_ids), pick(versions), pick(faces), pick(positions),
+                                    pick(indices), pick(normals), pick(groups), pick(face_ids), pick(prepared), lod=lod)
+            if not is_preview:
+                for i in keep:
+                    self.refacet_applied[(filename, plasticity_ids[i], lod)] = generation
+        register_when_prepared([{"prepared": future} for future in prepared], apply)
 
     def connect(self, server):
         loop = self.loop
@@ -234,7 +474,13 @@ class PlasticityClient:
                 self.websocket = weakref.proxy(ws)
                 self.connected = True
                 self.message_id = 0
+                self.__reset_refacets()
+                self.refacet_latest = {}
+                self.refacet_applied = {}
+                self.pull_requests = {}
                 self.server = server
+                self.governor.reset()
+                self.puller.reset()
                 self.handler.on_connect()
 
                 while True:
@@ -250,8 +496,9 @@ class PlasticityClient:
                             {'INFO'}, f"Disconnected from server: {e}")
                         self.connected = False
                         self.websocket = None
-                        self.filename = None
+                        self.filenames = []
                         self.subscribed = False
+                        self.__reset_refacets()
                         self.handler.on_disconnect()
                         break
                     except Exception as e:
@@ -260,8 +507,9 @@ class PlasticityClient:
             self.report({'INFO'}, "Disconnected from server")
             self.connected = False
             self.websocket = None
-            self.filename = None
+            self.filenames = []
             self.subscribed = False
+            self.__reset_refacets()
             self.handler.on_disconnect()
         except InvalidURI:
             self.report(
@@ -292,12 +540,16 @@ class PlasticityClient:
             code = int.from_bytes(view[offset:offset + 4], 'little')
             offset += 4
 
+            known_versions = self.pull_requests.pop(message_id, None)
+
             if code != 200:
                 self.report({'ERROR'}, f"List all failed with code: {code}")
                 return
 
             # NOTE: ListAll only has an Add message inside it so it is a bit unlike a regular transaction
-            self.__on_transaction(view, offset, update_only=False)
+            self.__on_transaction(view, offset, update_only=False,
+                                  known_versions=known_versions,
+                                  partial=message_type == MessageType.LIST_SOME_1)
 
         elif message_type == MessageType.NEW_VERSION_1:
             filename_length = int.from_bytes(view[offset:offset + 4], 'little')
@@ -307,7 +559,7 @@ class PlasticityClient:
                             filename_length].tobytes().decode('utf-8')
             offset += filename_length
 
-            self.filename = filename
+            self.__add_filename(filename)
 
             # Add string padding for byte alignment
             padding = (4 - (filename_length % 4)) % 4
@@ -316,8 +568,10 @@ class PlasticityClient:
             version = int.from_bytes(view[offset:offset + 4], 'little')
             offset += 4
 
-            bpy.app.timers.register(
-                lambda: self.handler.on_new_version(filename, version), first_interval=0.001)
+            def on_new_version():
+                self.handler.on_new_version(filename, version)
+                self.puller.on_new_version(filename, version)
+            bpy.app.timers.register(on_new_version, first_interval=0.001)
 
         elif message_type == MessageType.NEW_FILE_1:
             filename_length = int.from_bytes(view[offset:offset + 4], 'little')
@@ -327,7 +581,7 @@ class PlasticityClient:
                             filename_length].tobytes().decode('utf-8')
             offset += filename_length
 
-            self.filename = filename
+            self.__add_filename(filename)
 
             bpy.app.timers.register(
                 lambda: self.handler.on_new_file(filename), first_interval=0.001)
@@ -335,7 +589,7 @@ class PlasticityClient:
         elif message_type == MessageType.REFACET_SOME_1:
             self.__on_refacet(view, offset)
 
-    def __on_transaction(self, view, offset, update_only):
+    def __on_transaction(self, view, offset, update_only, known_versions=None, partial=False):
         filename_length = int.from_bytes(view[offset:offset + 4], 'little')
         offset += 4
 
@@ -343,7 +597,7 @@ class PlasticityClient:
                         filename_length].tobytes().decode('utf-8')
         offset += filename_length
 
-        self.filename = filename
+        self.__add_filename(filename)
 
         # Add string padding for byte alignment
         padding = (4 - (filename_length % 4)) % 4
@@ -360,7 +614,7 @@ class PlasticityClient:
         self.report({'INFO'}, f"Num messages: {num_messages}")
 
         transaction = {"filename": filename, "version": version,
-                       "delete": [], "add": [], "update": []}
+                       "delete": [], "add": [], "update": [], "move": [], "attribute": []}
         for _ in range(num_messages):
             item_length = int.from_bytes(
                 view[offset:offset + 4], 'little')
@@ -370,17 +624,45 @@ class PlasticityClient:
                 view[offset:offset + item_length], transaction)
             offset += item_length
 
+        if partial:
+            # NOTE: a reply to LIST_SOME_1 only holds what was asked for, so it must not delete what it lacks; it is
+            # applied as an update instead of going through the list path
+            transaction["update"] = transaction["add"]
+            transaction["add"] = []
+            update_only = True
+
+        changed = transaction["add"] + transaction["update"]
+        if known_versions is not None:
+            # NOTE: a pull-on-save reply also carries objects Blender already has at this version; they take the
+            # version fast path when applied, so there is nothing to prepare for them
+            changed = [item for item in changed
+                       if item["type"] == ObjectType.GROUP.value
+                       or known_versions.get((filename, item["id"])) != item["version"]]
+
+        if not update_only:
+            # NOTE: list replies are put in priority order by bounding box (see ListJob); submitted first so that the
+            # boxes are ready before the meshes
+            prepare.submit_bounds(transaction["add"])
+        # NOTE: start deriving mesh arrays in the worker pool right away; the main thread only does the foreach_set
+        prepare.submit_items(changed)
+
         if update_only:
-            bpy.app.timers.register(lambda: self.handler.on_transaction(
-                transaction), first_interval=0.001)
+            self.governor.submit(transaction)
         else:
-            bpy.app.timers.register(lambda: self.handler.on_list(
-                transaction), first_interval=0.001)
+            # NOTE: applied in chunks, taking turns with the other files' updates
+            self.governor.submit_list(transaction)
 
     def __on_refacet(self, view, offset):
         message_id = int.from_bytes(view[offset:offset + 4], 'little')
         offset += 4
 
+        request = self.refacet_requests.pop(message_id, None)
+        if request is None:
+            request = self.refacet_expired.pop(message_id, {})
+        if self.refacet_outbox or self.prefetch_outbox:
+            # NOTE: a slot is free again, whatever the reply holds
+            self.loop.create_task(self.flush_refacets_async())
+
         code = int.from_bytes(view[offset:offset + 4], 'little')
         offset += 4
 
@@ -395,7 +677,7 @@ class PlasticityClient:
                         filename_length].tobytes().decode('utf-8')
         offset += filename_length
 
-        self.filename = filename
+        self.__add_filename(filename)
 
         # Add string padding for byte alignment
         padding = (4 - (filename_length % 4)) % 4
@@ -418,6 +700,7 @@ class PlasticityClient:
         normals = []
         groups = []
         face_ids = []
+        params = request.get("params")
 
         for _ in range(num_items):
             plasticity_id = int.from_bytes(
@@ -473,6 +756,15 @@ class PlasticityClient:
                 view[offset:offset + num_face_ids * 4], dtype=np.int32)
             offset += num_face_ids * 4
 
+            if params is not None:
+                self.refacet_cache.put((filename, plasticity_id, version, params),
+                                       (face, position, index, normal, group, face_id))
+            if request.get("prefetch"):
+                continue
+            if not self.__is_latest_refacet(filename, plasticity_id, request.get("lod"), request.get("generation")):
+                # NOTE: superseded by a newer request; it stays in the cache but is never applied
+                self.refacet_superseded += 1
+                continue
             plasticity_ids.append(plasticity_id)
             versions.append(version)
             faces.append(face)
@@ -482,8 +774,15 @@ class PlasticityClient:
             groups.append(group)
             face_ids.append(face_id)
 
-        bpy.app.timers.register(lambda: self.handler.on_refacet(filename, file_version, plasticity_ids,
-                                versions, faces, positions, indices, normals, groups, face_ids), first_interval=0.001)
+        if len(plasticity_ids) == 0:
+            return
+        self.__schedule_refacet(filename, file_version, plasticity_ids, versions,
+                                faces, positions, indices, normals, groups, face_ids, request.get("lod"),
+                                request.get("generation"), request.get("preview", False))
+
+    def __add_filename(self, filename):
+        if filename not in self.filenames:
+            self.filenames.append(filename)
 
     def on_message_item(self, view, transaction):
         offset = 0
@@ -494,7 +793,7 @@ class PlasticityClient:
         self.report({'INFO'}, f"Message type: {message_type}")
 
         if message_type == MessageType.DELETE_1:
-            num_objects = int.from_bytes(view[:4], 'little')
+            num_objects = int.from_bytes(view[offset:offset + 4], 'little')
             offset += 4
             transaction["delete"].extend(
                 np.frombuffer(view[offset:offset + num_objects * 4], dtype=np.int32))
@@ -502,6 +801,15 @@ class PlasticityClient:
             transaction["add"].extend(decode_objects(view[4:]))
         elif message_type == MessageType.UPDATE_1:
             transaction["update"].extend(decode_objects(view[4:]))
+        elif message_type == MessageType.MOVE_1 or message_type == MessageType.ATTRIBUTE_1:
+            # NOTE: a malformed metadata message is dropped whole rather than renaming or reparenting with garbage
+            try:
+                if message_type == MessageType.MOVE_1:
+                    transaction["move"].extend(decode_moves(view[4:]))
+                else:
+                    transaction["attribute"].extend(decode_attributes(view[4:]))
+            except ValueError as e:
+                self.report({'ERROR'}, f"Dropped malformed {message_type.name} message: {e}")
 
     def disconnect(self):
         if self.connected:
@@ -520,9 +828,10 @@ class PlasticityClient:
             del self.websocket
 
         self.connected = False
-        self.filename = None
+        self.filenames = []
         self.subscribed = False
         self.websocket = None
+        self.__reset_refacets()
         self.handler.on_disconnect()
         self.report({'INFO'}, "Disconnected from Plasticity server")
         return {'FINISHED'}
@@ -531,6 +840,21 @@ class PlasticityClient:
         self.handler.report(level, message)
 
 
+def chunked(values, size):
+    values = list(values)
+    return [values[start:start + size] for start in range(0, len(values), size)]
+
+
+def register_when_prepared(items, callback):
+    """Run callback on the main thread once the worker pool has prepared every item."""
+    def on_timer():
+        if not prepare.items_prepared(items):
+            return PREPARE_POLL_INTERVAL
+        callback()
+        return None
+    bpy.app.timers.register(on_timer, first_interval=0.001)
+
+
 def decode_objects(buffer):
     view = memoryview(buffer)
     num_objects = int.from_bytes(view[:4], 'little')
@@ -546,6 +870,87 @@ def decode_objects(buffer):
     return objects
 
 
+OBJECT_TYPES = frozenset(object_type.value for object_type in ObjectType)
+MOVE_RECORD_SIZE = 12
+
+
+def decode_moves(buffer):
+    """Re-parenting of items and groups: (type, id, parent_id) per entry, no geometry.
+
+    Raises ValueError if the message isn't exactly a count followed by that many records.
+    """
+    view = memoryview(buffer)
+    if len(view) < 4:
+        raise ValueError("truncated header")
+    num_moves = int.from_bytes(view[:4], 'little')
+    if len(view) != 4 + num_moves * MOVE_RECORD_SIZE:
+        raise ValueError("{} bytes for {} moves".format(len(view), num_moves))
+    offset = 4
+    moves = []
+
+    for _ in range(num_moves):
+        object_type = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        object_id = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        parent_id = int.from_bytes(view[offset:offset + 4], 'little', signed=True)
+        offset += 4
+
+        if object_type not in OBJECT_TYPES:
+            raise ValueError("unknown object type {}".format(object_type))
+        moves.append({"type": object_type, "id": object_id, "parent_id": parent_id})
+
+    return moves
+
+
+def decode_attributes(buffer):
+    """Renames and visibility changes of items and groups: (type, id, flags, name) per entry, no geometry.
+
+    Raises ValueError if a record runs past the end of the message, or the records don't fill it exactly.
+    """
+    view = memoryview(buffer)
+    if len(view) < 4:
+        raise ValueError("truncated header")
+    num_attributes = int.from_bytes(view[:4], 'little')
+    offset = 4
+    attributes = []
+
+    for _ in range(num_attributes):
+        if offset + 16 > len(view):
+            raise ValueError("truncated attribute record")
+
+        object_type = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        object_id = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        flags = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        name_length = int.from_bytes(view[offset:offset + 4], 'little')
+        offset += 4
+
+        # Add string padding for byte alignment
+        padding = (4 - (name_length % 4)) % 4
+        if offset + name_length + padding > len(view):
+            raise ValueError("name runs past the end of the message")
+
+        # NOTE: UnicodeDecodeError is a ValueError
+        name = view[offset:offset + name_length].tobytes().decode('utf-8')
+        offset += name_length + padding
+
+        if object_type not in OBJECT_TYPES:
+            raise ValueError("unknown object type {}".format(object_type))
+        attributes.append({"type": object_type, "id": object_id, "flags": flags, "name": name})
+
+    if offset != len(view):
+        raise ValueError("{} trailing bytes after {} attributes".format(len(view) - offset, num_attributes))
+    return attributes
+
+
 def decode_object_data(view, offset):
     object_type = int.from_bytes(view[offset:offset + 4], 'little')
     offset += 4
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+ARRAY_KEYS = ("vertices", "faces", "normals", "groups", "face_ids")
+
+
+def is_item_hidden(flags):
+    is_hidden = flags & 1
+    is_visible = flags & 2
+    return bool(is_hidden or not is_visible)
+
+
+class DeferredItems:
+    """Compact, unbuilt records for items that are hidden in Plasticity.
+
+    The decoded arrays are copied out of the message buffer (so the message itself can be freed) and either kept in
+    memory or spilled to .npy files in a temporary folder. The real mesh is built only when the item becomes visible
+    or is explicitly requested.
+    """
+
+    def __init__(self):
+        # NOTE: filename -> id -> record; a record is the decoded item with its arrays (or their paths) but no mesh
+        self.records = {}
+        self.directory = None
+
+    def __len__(self):
+        return sum(len(records) for records in self.records.values())
+
+    def __contains__(self, key):
+        filename, plasticity_id = key
+        return plasticity_id in self.records.get(filename, {})
+
+    def ids(self, filename):
+        return list(self.records.get(filename, {}).keys())
+
+    def get(self, filename, plasticity_id):
+        """The record of a deferred item, whose metadata (name, parent_id, flags) may be updated in place."""
+        return self.records.get(filename, {}).get(plasticity_id)
+
+    def defer(self, filename, item, to_disk=False):
+        prepared = item.get("prepared")
+        if prepared is not None:
+            prepared.cancel()
+
+        record = {key: value for key, value in item.items()
+                  if key not in ARRAY_KEYS and key not in ("prepared", "bounds")}
+        self.discard(filename, item["id"])
+
+        if to_disk:
+            folder = self.__folder_for(filename, item["id"])
+            for key in ARRAY_KEYS:
+                path = os.path.join(folder, key + ".npy")
+                np.save(path, item[key])
+                record[key] = path
+        else:
+            for key in ARRAY_KEYS:
+                record[key] = np.array(item[key])
+
+        self.records.setdefault(filename, {})[item["id"]] = record
+
+    def pop(self, filename, plasticity_id):
+        record = self.records.get(filename, {}).pop(plasticity_id, None)
+        if record is None:
+            return None
+
+        item = dict(record)
+        for key in ARRAY_KEYS:
+            if isinstance(record[key], str):
+                # NOTE: load fully so that the file can be removed right away
+                item[key] = np.load(record[key])
+        self.__remove_files(record)
+        return item
+
+    def discard(self, filename, plasticity_id):
+        record = self.records.get(filename, {}).pop(plasticity_id, None)
+        if record is not None:
+            self.__remove_files(record)
+
+    def clear(self):
+        self.records = {}
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __folder_for(self, filename, plasticity_id):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="plasticity_deferred_")
+        folder = os.path.join(self.directory, str(abs(hash(filename))), str(plasticity_id))
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def __remove_files(self, record):
+        for key in ARRAY_KEYS:
+            if isinstance(record[key], str) and os.path.exists(record[key]):
+                os.remove(record[key])
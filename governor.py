@@ -0,0 +1,297 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import bpy
+
+from . import prepare
+from .handler import ObjectType
+from .priority import prioritize
+
+# NOTE: fraction of main-thread time live-link applies may take; the rest is left to the UI and viewport
+MAX_DUTY_CYCLE = 0.5
+# NOTE: number of recent applies used to estimate the apply cost and the effective rate
+HISTORY_LENGTH = 8
+PREPARE_POLL_INTERVAL = 0.005
+# NOTE: items of a list reply applied per turn
+LIST_CHUNK_SIZE = 200
+
+
+def item_key(item):
+    # NOTE: items and groups have overlapping ids
+    return (item["type"] == ObjectType.GROUP.value, item["id"])
+
+
+def merge_transactions(pending, newer):
+    """Fold a newer transaction for the same file into a pending one, keeping only the latest state of every item."""
+    pending["version"] = newer["version"]
+
+    deleted = set(int(plasticity_id) for plasticity_id in newer["delete"])
+    if deleted:
+        for key in ("add", "update"):
+            pending[key] = [item for item in pending[key]
+                            if item_key(item)[0] or item["id"] not in deleted]
+        pending["delete"] = list(pending["delete"]) + list(deleted)
+
+    positions = {}
+    for key in ("add", "update"):
+        for i, item in enumerate(pending[key]):
+            positions[item_key(item)] = (key, i)
+
+    for key in ("add", "update"):
+        for item in newer[key]:
+            position = positions.get(item_key(item))
+            if position is not None:
+                # NOTE: replace in place so that a group added earlier is still created before its children
+                pending[position[0]][position[1]] = item
+            else:
+                positions[item_key(item)] = (key, len(pending[key]))
+                pending[key].append(item)
+
+    # NOTE: moves and attribute changes are applied after adds and updates, so a newer add/update supersedes them
+    superseded = set(item_key(item) for key in ("add", "update") for item in newer[key])
+    for key in ("move", "attribute"):
+        entries = {}
+        for entry in pending.get(key, []):
+            if item_key(entry) in superseded or (not item_key(entry)[0] and entry["id"] in deleted):
+                continue
+            entries[item_key(entry)] = entry
+        for entry in newer.get(key, []):
+            entries.pop(item_key(entry), None)
+            entries[item_key(entry)] = entry
+        pending[key] = list(entries.values())
+
+    return pending
+
+
+class FileMetrics:
+    """Per-file counters shown in the panel and used to throttle that file's live-link updates."""
+
+    def __init__(self):
+        self.apply_times = deque(maxlen=HISTORY_LENGTH)
+        self.apply_stamps = deque(maxlen=HISTORY_LENGTH)
+        self.last_apply = 0.0
+        self.applies = 0
+        self.items = 0
+        self.dropped = 0
+
+    def record(self, elapsed, items):
+        self.apply_times.append(elapsed)
+        self.last_apply = time.monotonic()
+        self.apply_stamps.append(self.last_apply)
+        self.applies += 1
+        self.items += items
+
+    @property
+    def apply_cost(self):
+        if len(self.apply_times) == 0:
+            return 0.0
+        return sum(self.apply_times) / len(self.apply_times)
+
+    @property
+    def effective_rate(self):
+        if len(self.apply_stamps) < 2:
+            return 0.0
+        span = time.monotonic() - self.apply_stamps[0]
+        if span <= 0:
+            return 0.0
+        return (len(self.apply_stamps) - 1) / span
+
+
+class ListJob:
+    """A list reply applied a chunk per turn: all groups first (children need their parents), then the items.
+
+    The items are put in priority order (selected, then in view, then the rest) when the job reaches the front of its
+    queue and the bounding boxes computed in the worker pool are in, so the objects the user is looking at appear
+    first.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.chunks = None
+
+    def plan(self, context):
+        message = self.message
+        groups = [item for item in message["add"] if item["type"] == ObjectType.GROUP.value]
+        items = [item for item in message["add"] if item["type"] != ObjectType.GROUP.value]
+        items = prioritize(items, context, message["filename"], context.scene.prop_plasticity_unit_scale)
+
+        self.chunks = deque()
+        if groups:
+            self.chunks.append(groups)
+        for start in range(0, len(items), LIST_CHUNK_SIZE):
+            self.chunks.append(items[start:start + LIST_CHUNK_SIZE])
+
+    def plannable(self):
+        return prepare.items_bounded(self.message["add"])
+
+    def ready(self):
+        return len(self.chunks) == 0 or prepare.items_prepared(self.chunks[0])
+
+
+class LiveLinkGovernor:
+    """Schedules what is applied to the scene, with one ordered queue per Plasticity file.
+
+    Live-link transactions that arrive while one is waiting are merged into it, so intermediate versions are dropped
+    but the newest state is always applied eventually; how often a file's transactions are applied is capped based on
+    how long its recent applies took. List replies are applied in chunks. Files take turns, one unit of work each, so
+    a large list of one file can't hold up the live link of another.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.lock = threading.Lock()
+        # NOTE: filename -> deque of transactions and ListJobs; the order of the dict is the round-robin order
+        self.queues = OrderedDict()
+        self.metrics = {}
+        self.timer_registered = False
+        self.timer = self.__on_timer
+        self.apply_times = deque(maxlen=HISTORY_LENGTH)
+        self.apply_stamps = deque(maxlen=HISTORY_LENGTH)
+
+    def submit(self, transaction):
+        filename = transaction["filename"]
+        with self.lock:
+            queue = self.queues.setdefault(filename, deque())
+            metrics = self.metrics.setdefault(filename, FileMetrics())
+            if queue and isinstance(queue[-1], dict):
+                merge_transactions(queue[-1], transaction)
+                metrics.dropped += 1
+            else:
+                queue.append(transaction)
+        self.__schedule()
+
+    def submit_list(self, message):
+        filename = message["filename"]
+        with self.lock:
+            self.queues.setdefault(filename, deque()).append(ListJob(message))
+            self.metrics.setdefault(filename, FileMetrics())
+        self.__schedule()
+
+    def reset(self):
+        with self.lock:
+            self.queues = OrderedDict()
+            self.metrics = {}
+        self.apply_times.clear()
+        self.apply_stamps.clear()
+
+    def cancel(self):
+        """Drop everything queued and stop the timer, e.g. because the addon is being unregistered."""
+        self.reset()
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.timer_registered = False
+
+    @property
+    def dropped(self):
+        return sum(metrics.dropped for metrics in self.metrics.values())
+
+    @property
+    def apply_cost(self):
+        if len(self.apply_times) == 0:
+            return 0.0
+        return sum(self.apply_times) / len(self.apply_times)
+
+    @property
+    def effective_rate(self):
+        if len(self.apply_stamps) < 2:
+            return 0.0
+        span = time.monotonic() - self.apply_stamps[0]
+        if span <= 0:
+            return 0.0
+        return (len(self.apply_stamps) - 1) / span
+
+    def min_interval(self, scene, metrics=None):
+        if not scene.prop_plasticity_livelink_throttle:
+            return 0.0
+        apply_cost = metrics.apply_cost if metrics is not None else self.apply_cost
+        return max(1.0 / scene.prop_plasticity_livelink_max_rate, apply_cost / MAX_DUTY_CYCLE)
+
+    def pending(self, filename):
+        with self.lock:
+            return len(self.queues.get(filename, ()))
+
+    def __schedule(self):
+        with self.lock:
+            schedule = not self.timer_registered
+            self.timer_registered = True
+        if schedule:
+            # NOTE: persistent, so loading a .blend doesn't drop the timer and leave timer_registered stuck
+            bpy.app.timers.register(self.timer, first_interval=0.001, persistent=True)
+
+    def __next_unit(self, context):
+        """Pick the first file, in round-robin order, whose next unit of work can be applied now."""
+        scene = context.scene
+        now = time.monotonic()
+        wait = None
+        for filename, queue in self.queues.items():
+            unit = queue[0]
+            if isinstance(unit, ListJob):
+                ready = unit.plannable() if unit.chunks is None else unit.ready()
+                if ready:
+                    return filename, unit, 0.0
+                wait = PREPARE_POLL_INTERVAL if wait is None else min(wait, PREPARE_POLL_INTERVAL)
+                continue
+
+            metrics = self.metrics[filename]
+            remaining = metrics.last_apply + self.min_interval(scene, metrics) - now
+            if remaining > 0:
+                wait = remaining if wait is None else min(wait, remaining)
+            elif not (prepare.items_prepared(unit["add"]) and prepare.items_prepared(unit["update"])):
+                wait = PREPARE_POLL_INTERVAL if wait is None else min(wait, PREPARE_POLL_INTERVAL)
+            else:
+                return filename, unit, 0.0
+        return None, None, wait
+
+    def __on_timer(self):
+        with self.lock:
+            for filename in [filename for filename, queue in self.queues.items() if not queue]:
+                del self.queues[filename]
+            if not self.queues:
+                self.timer_registered = False
+                return None
+
+            filename, unit, wait = self.__next_unit(bpy.context)
+            if unit is None:
+                return wait
+
+            unplanned = isinstance(unit, ListJob) and unit.chunks is None
+            if not unplanned:
+                queue = self.queues[filename]
+                if isinstance(unit, ListJob):
+                    chunk = unit.chunks.popleft() if unit.chunks else []
+                    finished = len(unit.chunks) == 0
+                    if finished:
+                        queue.popleft()
+                else:
+                    queue.popleft()
+                # NOTE: the file that was just served goes to the back of the line
+                self.queues.move_to_end(filename)
+                metrics = self.metrics[filename]
+
+        if unplanned:
+            # NOTE: outside the lock, so the websocket thread's submit() isn't held up; the job keeps its turn
+            unit.plan(bpy.context)
+            return 0.001
+
+        start = time.perf_counter()
+        try:
+            if isinstance(unit, ListJob):
+                self.handler.on_list_chunk(unit.message, chunk)
+                if finished:
+                    self.handler.on_list_finish(unit.message)
+                items = len(chunk)
+            else:
+                self.handler.on_transaction(unit)
+                items = len(unit["add"]) + len(unit["update"]) + len(unit["delete"])
+        except Exception as e:
+            self.handler.report({'ERROR'}, f"Failed to apply update: {e}")
+            items = 0
+        elapsed = time.perf_counter() - start
+
+        metrics.record(elapsed, items)
+        self.apply_times.append(elapsed)
+        self.apply_stamps.append(metrics.last_apply)
+
+        # NOTE: one unit of work per tick, so the UI and viewport get their turn in between
+        return 0.001
@@ -3,10 +3,17 @@
 from collections import defaultdict
 from enum import Enum
 
+import bmesh
 import bpy
 import mathutils
 import numpy as np
 
+from . import prepare
+from .deferred import DeferredItems, is_item_hidden
+from .lod import clear_lods, lod_key, lod_levels, lod_mesh
+from .prepare import face_group_indices
+from .undo import UndoCoalescer
+
 
 class PlasticityIdUniquenessScope(Enum):
     ITEM = 0
@@ -22,161 +29,167 @@ class ObjectType(Enum):
     EMPTY = 6
 
 
+# NOTE: per-polygon integer attributes written at ingest, so operators don't have to scan "groups"
+FACE_GROUP_ATTRIBUTE = "plasticity_group"
+FACE_ID_ATTRIBUTE = "plasticity_face_id"
+
+
+def write_face_attributes(mesh, face_group, face_id):
+    for name, values in ((FACE_GROUP_ATTRIBUTE, face_group), (FACE_ID_ATTRIBUTE, face_id)):
+        attribute = mesh.attributes.get(name)
+        if attribute is None or attribute.domain != 'FACE' or attribute.data_type != 'INT':
+            if attribute is not None:
+                mesh.attributes.remove(attribute)
+            attribute = mesh.attributes.new(name, 'INT', 'FACE')
+        attribute.data.foreach_set("value", values)
+
+
+def reclaim_orphans(datablocks):
+    """Free the given meshes, and the Plasticity-owned materials they used, once nothing else uses them."""
+    meshes = set()
+    materials = set()
+    for datablock in datablocks:
+        try:
+            if isinstance(datablock, bpy.types.Mesh):
+                meshes.add(datablock)
+                materials.update(material for material in datablock.materials
+                                 if material is not None and material.get("plasticity_owned"))
+            elif isinstance(datablock, bpy.types.Material):
+                materials.add(datablock)
+        except ReferenceError:
+            # NOTE: already freed, e.g. by undo
+            continue
+
+    # NOTE: meshes first, since an orphaned mesh still counts as a user of its materials
+    orphan_meshes = [mesh for mesh in meshes if mesh.users == 0]
+    if orphan_meshes:
+        bpy.data.batch_remove(orphan_meshes)
+    orphan_materials = [material for material in materials if material.users == 0]
+    if orphan_materials:
+        bpy.data.batch_remove(orphan_materials)
+    return len(orphan_meshes) + len(orphan_materials)
+
+
 class SceneHandler:
     def __init__(self):
         # NOTE: filename -> [item/group] -> id -> object
         # NOTE: items/groups have overlapping ids
         # NOTE: it turns out that caching this is unsafe with undo/redo; call __prepare() before every update
         self.files = {}
-
-    def __create_mesh(self, name, verts, indices, normals, groups, face_ids):
-        mesh = bpy.data.meshes.new(name)
-        mesh.vertices.add(len(verts) // 3)
-        mesh.vertices.foreach_set("co", verts)
-        mesh.loops.add(len(indices))
-        mesh.loops.foreach_set("vertex_index", indices)
-        mesh.polygons.add(len(indices) // 3)
-        mesh.polygons.foreach_set("loop_total", np.full(
-            len(indices) // 3, 3, dtype=np.int32))
-        mesh.polygons.foreach_set("loop_start", np.arange(
-            0, len(indices), 3, dtype=np.int32))
+        # NOTE: filename -> the list reply whose chunks may reuse self.files[filename] instead of calling __prepare()
+        self.list_index = {}
+        self.undo = UndoCoalescer()
+        self.deferred = DeferredItems()
+        # NOTE: datablocks of deleted objects, freed in one batch at the end of every update
+        self.garbage = []
+        self.reclaimed = 0
+        # NOTE: names, collection links and visibility flags written vs. left alone because they were already right
+        self.metadata_writes = 0
+        self.metadata_skipped = 0
+
+    def __write_geometry(self, mesh, prepared):
+        # NOTE: everything derived from the message was computed off the main thread, see prepare.py
+        mesh.vertices.add(len(prepared.vertices) // 3)
+        mesh.vertices.foreach_set("co", prepared.vertices)
+        mesh.loops.add(len(prepared.loop_vertex_index))
+        mesh.loops.foreach_set("vertex_index", prepared.loop_vertex_index)
+        mesh.polygons.add(len(prepared.loop_start))
+        mesh.polygons.foreach_set("loop_start", prepared.loop_start)
+        mesh.polygons.foreach_set("loop_total", prepared.loop_total)
+        write_face_attributes(mesh, prepared.face_group, prepared.face_id)
 
         mesh.update()
 
-        denormalized_normals = np.zeros((len(indices), 3), dtype=np.float32)
-        denormalized_normals = normals.reshape(-1, 3)[indices]
-        mesh.normals_split_custom_set(denormalized_normals)
+        mesh.normals_split_custom_set(prepared.loop_normals)
+
+    def __create_mesh(self, name, prepared, groups, face_ids):
+        mesh = bpy.data.meshes.new(name)
+        self.__write_geometry(mesh, prepared)
         if hasattr(mesh, 'use_auto_smooth'):
             mesh.use_auto_smooth = True
 
         mesh["groups"] = groups
         mesh["face_ids"] = face_ids
-        mesh["normals_split_custom"] = denormalized_normals
+        mesh["normals_split_custom"] = prepared.loop_normals
 
         return mesh
 
-    def __update_object_and_mesh(self, obj, object_type, version, name, verts, indices, normals, groups, face_ids):
-        if obj.mode == 'EDIT':
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        obj.name = name
-
-        mesh = obj.data
-        mesh.clear_geometry()
+    def __write_edit_mesh(self, mesh, prepared):
+        # NOTE: patch the edit-mode BMesh in place rather than toggling the object out of edit mode and back, which
+        # converts the whole mesh twice. Custom normals and face attributes come along through from_mesh.
+        staging = bpy.data.meshes.new(mesh.name + "_staging")
+        self.__write_geometry(staging, prepared)
 
-        mesh.vertices.add(len(verts) // 3)
-        mesh.vertices.foreach_set("co", verts)
+        bm = bmesh.from_edit_mesh(mesh)
+        bm.clear()
+        bm.from_mesh(staging)
+        bmesh.update_edit_mesh(mesh, loop_triangles=True, destructive=True)
 
-        mesh.loops.add(len(indices))
-        mesh.loops.foreach_set("vertex_index", indices)
-
-        mesh.polygons.add(len(indices) // 3)
-        mesh.polygons.foreach_set("loop_start", range(0, len(indices), 3))
-        mesh.polygons.foreach_set("loop_total", [3] * (len(indices) // 3))
+        bpy.data.meshes.remove(staging)
 
+    def __replace_geometry(self, obj, mesh, prepared, groups, face_ids):
         mesh["groups"] = groups
         mesh["face_ids"] = face_ids
+        if obj.mode == 'EDIT' and mesh == obj.data:
+            self.__write_edit_mesh(mesh, prepared)
+        else:
+            mesh.clear_geometry()
+            self.__write_geometry(mesh, prepared)
 
-        mesh.update()
-
-        denormalized_normals = np.zeros((len(indices), 3), dtype=np.float32)
-        denormalized_normals = normals.reshape(-1, 3)[indices]
-        mesh.normals_split_custom_set(denormalized_normals)
-
-        self.update_pivot(obj)
-
-    def __update_mesh_ngons(self, obj, version, faces, verts, indices, normals, groups, face_ids):
-        if obj.mode == 'EDIT':
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        mesh = obj.data
-        mesh.clear_geometry()
-
-        verts_array = np.array(verts).reshape(-1, 3)
-        unique_verts, inverse_indices = np.unique(
-            verts_array, axis=0, return_inverse=True)
-        new_indices = inverse_indices[indices]
-
-        mesh.vertices.add(len(unique_verts))
-        mesh.vertices.foreach_set("co", unique_verts.ravel())
+    def __update_object_and_mesh(self, obj, object_type, version, name, prepared, groups, face_ids):
+        self.__set_name(obj, name)
 
-        mesh.loops.add(len(indices))
-        mesh.loops.foreach_set("vertex_index", new_indices)
+        clear_lods(obj)
+        self.__replace_geometry(obj, obj.data, prepared, groups, face_ids)
 
-        if (len(faces) == 0):
-            mesh.polygons.add(len(new_indices) // 3)
-            mesh.polygons.foreach_set(
-                "loop_start", range(0, len(new_indices), 3))
-            mesh.polygons.foreach_set(
-                "loop_total", [3] * (len(new_indices) // 3))
-        else:
-            # Find where a new face/polygon starts (value changes in the array)
-            diffs = np.where(np.diff(faces))[0] + 1
-            # Insert the starting index for the first polygon
-            loop_start = np.insert(diffs, 0, 0)
-            # Calculate the number of vertices per polygon
-            loop_total = np.append(np.diff(loop_start), [
-                                   len(faces) - loop_start[-1]])
-            mesh.polygons.add(len(loop_start))
-            mesh.polygons.foreach_set("loop_start", loop_start)
-            mesh.polygons.foreach_set("loop_total", loop_total)
+    def __update_mesh_ngons(self, obj, version, prepared, groups, face_ids, mesh=None):
+        if mesh is None:
+            mesh = obj.data
 
-        mesh["groups"] = groups
-        mesh["face_ids"] = face_ids
-
-        mesh.update()
+        self.__replace_geometry(obj, mesh, prepared, groups, face_ids)
 
         if hasattr(mesh, 'use_auto_smooth'):
             mesh.use_auto_smooth = True
-        denormalized_normals = np.zeros((len(indices), 3), dtype=np.float32)
-        denormalized_normals = normals.reshape(-1, 3)[indices]
-        mesh.normals_split_custom_set(denormalized_normals)
-
-        self.update_pivot(obj)
-
-    def update_pivot(self, obj):
-        # NOTE: this doesn't work unfortunately. It seems like changing matrix_world or matrix_local
-        # is only possible in special contexts that I cannot yet figure out.
-        return
-        if not "plasticity_transform" in obj:
-            return
-        transform_list = obj["plasticity_transform"]
-        if transform_list is not None:
-            bpy.context.view_layer.objects.active = obj
-            obj.select_set(True)
-            bpy.ops.object.mode_set(mode='OBJECT')
-            old_matrix_world = obj.matrix_world.copy()
-            transform = np.array(transform_list).reshape(4, 4)
-            obj.matrix_world = mathutils.Matrix(transform)
-            obj.matrix_world.invert()
-            bpy.ops.object.transform_apply(
-                location=True, rotation=True, scale=True)
-            obj.matrix_world = old_matrix_world
 
     def __add_object(self, filename, object_type, plasticity_id, name, mesh):
         mesh_obj = bpy.data.objects.new(name, mesh)
         self.files[filename][PlasticityIdUniquenessScope.ITEM][plasticity_id] = mesh_obj
         mesh_obj["plasticity_id"] = plasticity_id
         mesh_obj["plasticity_filename"] = filename
+        mesh_obj["plasticity_name"] = name
         return mesh_obj
 
     def __delete_object(self, filename, version, plasticity_id):
+        self.deferred.discard(filename, plasticity_id)
         obj = self.files[filename][PlasticityIdUniquenessScope.ITEM].pop(
             plasticity_id, None)
         if obj:
+            if obj.type == 'MESH':
+                self.garbage.append(obj.data)
+                self.garbage.extend(obj.get(lod_key(level))
+                                    for level in range(lod_levels(obj)))
             bpy.data.objects.remove(obj, do_unlink=True)
 
     def __delete_group(self, filename, version, plasticity_id):
         group = self.files[filename][PlasticityIdUniquenessScope.GROUP].pop(
             plasticity_id, None)
         if group:
-            bpy.data.groups.remove(group, do_unlink=True)
+            bpy.data.collections.remove(group, do_unlink=True)
+
+    def __reclaim(self):
+        garbage = [datablock for datablock in self.garbage if datablock is not None]
+        self.garbage = []
+        if len(garbage) == 0:
+            return
+        reclaimed = reclaim_orphans(garbage)
+        self.reclaimed += reclaimed
+        self.report({'INFO'}, "Freed " + str(reclaimed) + " unused meshes and materials")
 
-    def __replace_objects(self, filename, inbox_collection, version, objects):
+    def __replace_objects(self, filename, inbox_collection, version, objects, defer_hidden=None):
         scene = bpy.context.scene
         prop_plasticity_unit_scale = scene.prop_plasticity_unit_scale
-
-        collections_to_unlink = set()
+        if defer_hidden is None:
+            defer_hidden = scene.prop_plasticity_defer_hidden
 
         for item in objects:
             object_type = item['type']
@@ -185,67 +198,68 @@ class SceneHandler:
             material_id = item['material_id']
             parent_id = item['parent_id']
             flags = item['flags']
-            verts = item['vertices']
-            faces = item['faces']
-            normals = item['normals']
             groups = item['groups']
             face_ids = item['face_ids']
 
             if object_type == ObjectType.SOLID.value or object_type == ObjectType.SHEET.value:
                 obj = None
                 if plasticity_id not in self.files[filename][PlasticityIdUniquenessScope.ITEM]:
+                    if defer_hidden and is_item_hidden(flags):
+                        # NOTE: keep hidden items as unbuilt records until they become visible or are requested
+                        self.deferred.defer(
+                            filename, item, to_disk=scene.prop_plasticity_defer_to_disk)
+                        continue
+                    self.deferred.discard(filename, plasticity_id)
                     mesh = self.__create_mesh(
-                        name, verts, faces, normals, groups, face_ids)
+                        name, prepare.resolve(item), groups, face_ids)
                     obj = self.__add_object(filename, object_type,
                                             plasticity_id, name, mesh)
+                    obj["plasticity_version"] = item['version']
                     obj.scale = (prop_plasticity_unit_scale,
                                  prop_plasticity_unit_scale, prop_plasticity_unit_scale)
                 else:
                     obj = self.files[filename][PlasticityIdUniquenessScope.ITEM].get(
                         plasticity_id)
-                    if obj:
+                    if obj and obj.get("plasticity_version") == item['version'] and len(obj.data.polygons) > 0:
+                        # NOTE: the mesh is already at this version (e.g. after reopening the .blend), skip the geometry
+                        prepared = item.get("prepared")
+                        if prepared is not None:
+                            prepared.cancel()
+                        self.__set_name(obj, name)
+                    elif obj:
                         self.__update_object_and_mesh(
-                            obj, object_type, version, name, verts, faces, normals, groups, face_ids)
-                        for parent in obj.users_collection:
-                            parent.objects.unlink(obj)
+                            obj, object_type, version, name, prepare.resolve(item), groups, face_ids)
+                        obj["plasticity_version"] = item['version']
 
             elif object_type == ObjectType.GROUP.value:
                 if plasticity_id > 0:
                     group_collection = None
                     if plasticity_id not in self.files[filename][PlasticityIdUniquenessScope.GROUP]:
                         group_collection = bpy.data.collections.new(name)
+                        group_collection["plasticity_name"] = name
                         group_collection["plasticity_id"] = plasticity_id
                         group_collection["plasticity_filename"] = filename
                         self.files[filename][PlasticityIdUniquenessScope.GROUP][plasticity_id] = group_collection
                     else:
                         group_collection = self.files[filename][PlasticityIdUniquenessScope.GROUP].get(
                             plasticity_id)
-                        group_collection.name = name
-                        collections_to_unlink.add(group_collection)
-
-
-        # Unlink all mirrored collections, in case they have moved. It doesn't seem like there is a more efficient way to do this??
-        for potential_parent in bpy.data.collections:
-            to_unlink = [
-                child for child in potential_parent.children if child in collections_to_unlink]
-            for child in to_unlink:
-                potential_parent.children.unlink(child)
+                        self.__set_name(group_collection, name)
 
+        group_parents = {}
         for item in objects:
             object_type = item['type']
             uniqueness_scope = PlasticityIdUniquenessScope.ITEM if object_type != ObjectType.GROUP.value else PlasticityIdUniquenessScope.GROUP
             plasticity_id = item['id']
             parent_id = item['parent_id']
             flags = item['flags']
-            is_hidden = flags & 1
-            is_visible = flags & 2
-            is_selectable = flags & 4
 
             if plasticity_id == 0:  # root group
                 continue
 
             obj = self.files[filename][uniqueness_scope].get(
                 plasticity_id)
+            if not obj and uniqueness_scope == PlasticityIdUniquenessScope.ITEM and (filename, plasticity_id) in self.deferred:
+                continue
             if not obj:
                 self.report(
                     {'ERROR'}, "Object of type {} with id {} and parent_id {} not found".format(
@@ -261,13 +275,144 @@ class SceneHandler:
                 continue
 
             if object_type == ObjectType.GROUP.value:
-                parent.children.link(obj)
-                group_collection.hide_viewport = is_hidden or not is_visible
-                group_collection.hide_select = not is_selectable
+                group_parents[obj] = parent
+                self.__set_visibility(obj, True, flags)
             else:
-                parent.objects.link(obj)
-                obj.hide_set(is_hidden or not is_visible)
-                obj.hide_select = not is_selectable
+                self.__link_object(obj, parent)
+                self.__set_visibility(obj, False, flags)
+
+        self.__link_groups(group_parents)
+
+    def __set_name(self, datablock, name):
+        # NOTE: renaming runs Blender's unique-name resolution even when the name doesn't change. Compare against the
+        # name Plasticity sent last, since a duplicate name gets a suffix (e.g. "Body.001") and never matches
+        if datablock.get("plasticity_name") == name:
+            self.metadata_skipped += 1
+            return
+        datablock.name = name
+        datablock["plasticity_name"] = name
+        self.metadata_writes += 1
+
+    def __set_visibility(self, obj, is_group, flags):
+        is_hidden = flags & 1
+        is_visible = flags & 2
+        is_selectable = flags & 4
+        hide = bool(is_hidden or not is_visible)
+        hide_select = not is_selectable
+
+        current_hide = obj.hide_viewport if is_group else obj.hide_get()
+        if current_hide != hide:
+            if is_group:
+                obj.hide_viewport = hide
+            else:
+                obj.hide_set(hide)
+            self.metadata_writes += 1
+        else:
+            self.metadata_skipped += 1
+
+        if obj.hide_select != hide_select:
+            obj.hide_select = hide_select
+            self.metadata_writes += 1
+        else:
+            self.metadata_skipped += 1
+
+    def __link_object(self, obj, parent):
+        # NOTE: every link change rebuilds the outliner and the depsgraph relations, so leave correct links alone
+        users_collection = obj.users_collection
+        if len(users_collection) == 1 and users_collection[0] == parent:
+            self.metadata_skipped += 1
+            return
+        for previous in users_collection:
+            if previous != parent:
+                previous.objects.unlink(obj)
+        if parent not in obj.users_collection:
+            parent.objects.link(obj)
+        self.metadata_writes += 1
+
+    def __link_groups(self, group_parents):
+        moved = {}
+        for group_collection, parent in group_parents.items():
+            if group_collection.name in parent.children:
+                self.metadata_skipped += 1
+            else:
+                moved[group_collection] = parent
+        if not moved:
+            return
+
+        # NOTE: collections don't know their parents, so finding the old ones means scanning every collection; only
+        # do it when a group that is already linked somewhere has moved
+        if any(group_collection.users > 0 for group_collection in moved):
+            for potential_parent in bpy.data.collections:
+                to_unlink = [child for child in potential_parent.children
+                             if child in moved and moved[child] != potential_parent]
+                for child in to_unlink:
+                    potential_parent.children.unlink(child)
+        for group_collection, parent in moved.items():
+            parent.children.link(group_collection)
+        self.metadata_writes += len(moved)
+
+    def __move_objects(self, filename, inbox_collection, moves):
+        group_parents = {}
+        for move in moves:
+            is_group = move["type"] == ObjectType.GROUP.value
+            uniqueness_scope = PlasticityIdUniquenessScope.GROUP if is_group else PlasticityIdUniquenessScope.ITEM
+            plasticity_id = move["id"]
+            parent_id = move["parent_id"]
+
+            obj = self.files[filename][uniqueness_scope].get(plasticity_id)
+            if not obj:
+                record = None if is_group else self.deferred.get(filename, plasticity_id)
+                if record is not None:
+                    record["parent_id"] = parent_id
+                    continue
+                self.report(
+                    {'ERROR'}, "Object of type {} with id {} not found".format(move["type"], plasticity_id))
+                continue
+
+            parent = inbox_collection if parent_id == 0 else self.files[filename][PlasticityIdUniquenessScope.GROUP].get(
+                parent_id)
+            if not parent:
+                self.report(
+                    {'ERROR'}, "Parent of object of type {} with id {} and parent_id {} not found".format(
+                        move["type"], plasticity_id, parent_id))
+                continue
+
+            if is_group:
+                group_parents[obj] = parent
+            else:
+                self.__link_object(obj, parent)
+
+        self.__link_groups(group_parents)
+
+    def __set_attributes(self, filename, inbox_collection, attributes):
+        materialize = []
+        for attribute in attributes:
+            is_group = attribute["type"] == ObjectType.GROUP.value
+            uniqueness_scope = PlasticityIdUniquenessScope.GROUP if is_group else PlasticityIdUniquenessScope.ITEM
+            plasticity_id = attribute["id"]
+            flags = attribute["flags"]
+
+            obj = self.files[filename][uniqueness_scope].get(plasticity_id)
+            if not obj:
+                record = None if is_group else self.deferred.get(filename, plasticity_id)
+                if record is not None:
+                    record["name"] = attribute["name"]
+                    record["flags"] = flags
+                    if not is_item_hidden(flags):
+                        materialize.append(plasticity_id)
+                    continue
+                self.report(
+                    {'ERROR'}, "Object of type {} with id {} not found".format(attribute["type"], plasticity_id))
+                continue
+
+            self.__set_name(obj, attribute["name"])
+            self.__set_visibility(obj, is_group, flags)
+
+        if materialize:
+            # NOTE: items that were deferred while hidden are built once they are shown
+            items = [self.deferred.pop(filename, plasticity_id) for plasticity_id in materialize]
+            self.__replace_objects(filename, inbox_collection, None,
+                                   [item for item in items if item is not None], defer_hidden=False)
 
     def __inbox_for_filename(self, filename):
         plasticity_collection = bpy.data.collections.get("Plasticity")
@@ -292,6 +437,8 @@ class SceneHandler:
         return inbox_collection
 
     def __prepare(self, filename):
+        # NOTE: any other update of the file may change what it contains, so a list reply has to index it again
+        self.list_index.pop(filename, None)
         inbox_collection = self.__inbox_for_filename(filename)
 
         def gather_items(collection):
@@ -332,7 +479,6 @@ class SceneHandler:
 
         self.report({'INFO'}, "Updating " + filename +
                     " to version " + str(version))
-        bpy.ops.ed.undo_push(message="Plasticity update")
 
         inbox_collection = self.__prepare(filename)
 
@@ -348,28 +494,70 @@ class SceneHandler:
             self.__replace_objects(filename, inbox_collection,
                                    version, transaction["update"])
 
-        bpy.ops.ed.undo_push(message="/Plasticity update")
+        if "move" in transaction:
+            self.__move_objects(filename, inbox_collection, transaction["move"])
+
+        if "attribute" in transaction:
+            self.__set_attributes(filename, inbox_collection, transaction["attribute"])
+
+        self.__reclaim()
+        self.undo.push("Plasticity update")
 
     def on_list(self, message):
+        self.on_list_chunk(message, message.get("add", []))
+        self.on_list_finish(message)
+
+    def on_list_chunk(self, message, items):
+        """Apply part of a list reply; on_list_finish must follow once every chunk has been applied."""
         filename = message["filename"]
         version = message["version"]
 
         self.report({'INFO'}, "Updating " + filename +
                     " to version " + str(version))
-        bpy.ops.ed.undo_push(message="Plasticity update")
 
-        inbox_collection = self.__prepare(filename)
+        # NOTE: walking the inbox for every chunk would make a large list quadratic, so index it once per reply
+        if self.list_index.get(filename) is message and self.__index_is_live(filename, items):
+            inbox_collection = self.__inbox_for_filename(filename)
+        else:
+            inbox_collection = self.__prepare(filename)
+            self.list_index[filename] = message
+        self.__replace_objects(filename, inbox_collection,
+                               version, items)
+
+    def __index_is_live(self, filename, items):
+        """Whether none of the datablocks the items map to were deleted since the file was indexed."""
+        index = self.files.get(filename)
+        if index is None:
+            return False
+        groups = index[PlasticityIdUniquenessScope.GROUP]
+        try:
+            for item in items:
+                own_scope = groups if item["type"] == ObjectType.GROUP.value else index[PlasticityIdUniquenessScope.ITEM]
+                for datablock in (own_scope.get(item["id"]), groups.get(item["parent_id"])):
+                    if datablock is not None:
+                        datablock.name
+        except ReferenceError:
+            return False
+        return True
+
+    def forget_list_index(self):
+        """Undo, redo and loading a .blend free the indexed datablocks, so the next list chunk must index again."""
+        self.list_index = {}
+
+    def on_list_finish(self, message):
+        """Delete whatever the list reply no longer contains."""
+        filename = message["filename"]
+        version = message["version"]
+
+        self.__prepare(filename)
 
         all_items = set()
         all_groups = set()
-        if "add" in message:
-            for item in message["add"]:
-                if item["type"] == ObjectType.GROUP.value:
-                    all_groups.add(item["id"])
-                else:
-                    all_items.add(item["id"])
-            self.__replace_objects(filename, inbox_collection,
-                                   version, message["add"])
+        for item in message.get("add", []):
+            if item["type"] == ObjectType.GROUP.value:
+                all_groups.add(item["id"])
+            else:
+                all_items.add(item["id"])
 
         to_delete = []
         for plasticity_id, obj in self.files[filename][PlasticityIdUniquenessScope.ITEM].items():
@@ -377,6 +565,9 @@ class SceneHandler:
                 to_delete.append(plasticity_id)
         for plasticity_id in to_delete:
             self.__delete_object(filename, version, plasticity_id)
+        for plasticity_id in self.deferred.ids(filename):
+            if plasticity_id not in all_items:
+                self.deferred.discard(filename, plasticity_id)
 
         to_delete = []
         for plasticity_id, obj in self.files[filename][PlasticityIdUniquenessScope.GROUP].items():
@@ -385,19 +576,15 @@ class SceneHandler:
         for plasticity_id in to_delete:
             self.__delete_group(filename, version, plasticity_id)
 
-        bpy.ops.ed.undo_push(message="/Plasticity update")
+        self.__reclaim()
+        self.undo.push("Plasticity update")
 
-    def on_refacet(self, filename, version, plasticity_ids, versions, faces, positions, indices, normals, groups, face_ids):
+    def on_refacet(self, filename, version, plasticity_ids, versions, faces, positions, indices, normals, groups, face_ids, prepared=None, lod=None):
         self.report({'INFO'}, "Refaceting " + filename +
                     " to version " + str(version))
-        bpy.ops.ed.undo_push(message="Plasticity refacet")
 
         self.__prepare(filename)
 
-        prev_obj_mode = bpy.context.object.mode if bpy.context.object else None
-        prev_active_object = bpy.context.view_layer.objects.active
-        prev_selected_objects = bpy.context.selected_objects
-
         for i in range(len(plasticity_ids)):
             plasticity_id = plasticity_ids[i]
             version = versions[i]
@@ -411,16 +598,47 @@ class SceneHandler:
             obj = self.files[filename][PlasticityIdUniquenessScope.ITEM].get(
                 plasticity_id)
             if obj:
+                mesh_data = prepared[i].result() if prepared else prepare.prepare_ngons(
+                    face, position, index, normal, group, face_id)
+                if lod is None:
+                    clear_lods(obj)
+                    mesh = None
+                else:
+                    mesh = lod_mesh(obj, lod)
                 self.__update_mesh_ngons(
-                    obj, version, face, position, index, normal, group, face_id)
+                    obj, version, mesh_data, group, face_id, mesh)
+                obj["plasticity_version"] = version
+
+        self.undo.push("Plasticity refacet")
 
-        bpy.context.view_layer.objects.active = prev_active_object
-        for obj in prev_selected_objects:
-            obj.select_set(True)
-        if prev_obj_mode:
-            bpy.ops.object.mode_set(mode=prev_obj_mode)
+    def materialize_deferred(self, filename=None):
+        filenames = [filename] if filename else list(self.deferred.records.keys())
+        for filename in filenames:
+            plasticity_ids = self.deferred.ids(filename)
+            if len(plasticity_ids) == 0:
+                continue
+
+            self.report({'INFO'}, "Loading " + str(len(plasticity_ids)) +
+                        " hidden objects of " + filename)
+            inbox_collection = self.__prepare(filename)
+            items = [self.deferred.pop(filename, plasticity_id)
+                     for plasticity_id in plasticity_ids]
+            self.__replace_objects(filename, inbox_collection,
+                                   None, items, defer_hidden=False)
 
-        bpy.ops.ed.undo_push(message="/Plasticity refacet")
+        self.undo.push("Plasticity load hidden")
+
+    def known_versions(self, filename):
+        """(filename, plasticity_id) -> version of every object of filename that is built in Blender."""
+        versions = {}
+        for plasticity_id, obj in self.files.get(filename, {}).get(PlasticityIdUniquenessScope.ITEM, {}).items():
+            try:
+                version = obj.get("plasticity_version")
+            except ReferenceError:
+                continue
+            if version is not None:
+                versions[(filename, plasticity_id)] = version
+        return versions
 
     def on_new_version(self, filename, version):
         self.report({'INFO'}, "New version of " +
@@ -431,9 +649,16 @@ class SceneHandler:
 
     def on_connect(self):
         self.files = {}
+        self.list_index = {}
+        self.metadata_writes = 0
+        self.metadata_skipped = 0
+        self.deferred.clear()
 
     def on_disconnect(self):
         self.files = {}
+        self.list_index = {}
+        # NOTE: deferred records can't be matched to objects once the files are forgotten, so free their spilled arrays
+        self.deferred.clear()
 
     def report(self, level, message):
         print(message)
@@ -0,0 +1,73 @@
+import time
+
+import bpy
+
+from .refacet import group_by_facet_params, plasticity_objects_by_filename
+
+# NOTE: how long the facet settings must stay put before the selection is refaceted
+DEBOUNCE = 0.25
+POLL_INTERVAL = 0.05
+
+
+class LiveRefacet:
+    """Refacets the selection shortly after the facet settings change, e.g. while a slider is being dragged.
+
+    Changes restart the debounce, and a new request only goes out once the previous live refacet has come back, so at
+    most one parameter set is in flight; it is read when the request is sent, so it is always the newest one.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.deadline = 0.0
+        self.generations = []
+        self.timer_registered = False
+        self.timer = self.__on_timer
+
+    def schedule(self, context):
+        scene = context.scene
+        if not scene.prop_plasticity_live_refacet or not self.client.connected:
+            return
+        self.deadline = time.monotonic() + DEBOUNCE
+        if not self.timer_registered:
+            self.timer_registered = True
+            bpy.app.timers.register(self.timer, first_interval=DEBOUNCE, persistent=True)
+
+    def cancel(self):
+        self.deadline = 0.0
+        self.generations = []
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.timer_registered = False
+
+    def __in_flight(self):
+        client = self.client
+        generations = set(self.generations)
+        requests = client.refacets_in_flight() + list(client.refacet_outbox)
+        return any(request.get("generation") in generations for request in requests)
+
+    def __on_timer(self):
+        if self.deadline == 0.0 or not self.client.connected:
+            self.timer_registered = False
+            return None
+
+        wait = self.deadline - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.__in_flight():
+            return POLL_INTERVAL
+
+        self.deadline = 0.0
+        self.timer_registered = False
+
+        scene = bpy.context.scene
+        objects = [obj for obj in bpy.context.view_layer.objects.selected
+                   if obj.type == 'MESH' and "plasticity_id" in obj]
+        self.generations = []
+        for params, params_objects in group_by_facet_params(scene, objects).items():
+            for filename, file_objects in plasticity_objects_by_filename(params_objects).items():
+                generation = self.client.refacet_some(filename,
+                                                      [obj["plasticity_id"] for obj in file_objects],
+                                                      **params._asdict(),
+                                                      versions=[obj.get("plasticity_version") for obj in file_objects])
+                self.generations.append(generation)
+        return None
@@ -0,0 +1,136 @@
+import bpy
+from bpy.app.handlers import persistent
+from mathutils import Vector
+
+# NOTE: each coarser level multiplies the facet tolerances by this factor
+LOD_COARSENING = 4.0
+SWITCH_INTERVAL = 0.5
+
+rendering = False
+
+
+def lod_key(level):
+    return "plasticity_lod_" + str(level)
+
+
+def lod_levels(obj):
+    return obj.get("plasticity_lod_levels", 0)
+
+
+def lod_mesh(obj, level):
+    """The mesh holding the given level of detail of obj; level 0 is the mesh the object had before LODs existed."""
+    if lod_key(0) not in obj:
+        obj[lod_key(0)] = obj.data
+
+    mesh = obj.get(lod_key(level))
+    if mesh is None:
+        base = obj[lod_key(0)]
+        mesh = bpy.data.meshes.new(base.name + "_LOD" + str(level))
+        for material in base.materials:
+            mesh.materials.append(material)
+        obj[lod_key(level)] = mesh
+    obj["plasticity_lod_levels"] = max(lod_levels(obj), level + 1)
+    return mesh
+
+
+def set_lod(obj, level):
+    mesh = obj.get(lod_key(level))
+    while mesh is None and level > 0:
+        level -= 1
+        mesh = obj.get(lod_key(level))
+    if mesh is not None and obj.data != mesh:
+        obj.data = mesh
+
+
+def clear_lods(obj):
+    """Drop every level of detail but the base one, e.g. because the object's geometry was replaced."""
+    levels = lod_levels(obj)
+    if levels == 0:
+        return
+
+    # NOTE: an object in edit mode can't swap its mesh, so whatever it is editing becomes the base
+    keep = obj.data if obj.mode == 'EDIT' else obj.get(lod_key(0))
+    if keep is not None and obj.data != keep:
+        obj.data = keep
+
+    meshes = []
+    for level in range(levels):
+        mesh = obj.get(lod_key(level))
+        if lod_key(level) in obj:
+            del obj[lod_key(level)]
+        if mesh is not None and mesh != keep:
+            meshes.append(mesh)
+    del obj["plasticity_lod_levels"]
+
+    orphans = [mesh for mesh in meshes if mesh.users == 0]
+    if orphans:
+        bpy.data.batch_remove(orphans)
+
+
+def view_region_3d(context):
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                return area.spaces.active.region_3d
+    return None
+
+
+def viewpoint(context):
+    region_3d = view_region_3d(context)
+    if region_3d is None:
+        return None
+    return region_3d.view_matrix.inverted().translation
+
+
+def update_viewport_lods():
+    context = bpy.context
+    scene = context.scene
+    if rendering or scene is None:
+        return SWITCH_INTERVAL
+
+    eye = viewpoint(context) if scene.prop_plasticity_lod_mode else None
+    switch_distance = scene.prop_plasticity_lod_distance
+
+    for obj in scene.objects:
+        levels = lod_levels(obj)
+        if levels < 2 or obj.mode == 'EDIT':
+            continue
+        if eye is None:
+            set_lod(obj, 0)
+            continue
+        center = sum((Vector(corner) for corner in obj.bound_box), Vector()) / 8
+        distance = (obj.matrix_world @ center - eye).length
+        set_lod(obj, min(int(distance / switch_distance), levels - 1))
+
+    return SWITCH_INTERVAL
+
+
+@persistent
+def on_render_pre(scene, *args):
+    global rendering
+    rendering = True
+    for obj in scene.objects:
+        if lod_levels(obj) > 1:
+            set_lod(obj, 0)
+
+
+@persistent
+def on_render_done(scene, *args):
+    global rendering
+    rendering = False
+
+
+def register():
+    bpy.app.handlers.render_pre.append(on_render_pre)
+    bpy.app.handlers.render_complete.append(on_render_done)
+    bpy.app.handlers.render_cancel.append(on_render_done)
+    bpy.app.timers.register(
+        update_viewport_lods, first_interval=SWITCH_INTERVAL, persistent=True)
+
+
+def unregister():
+    if bpy.app.timers.is_registered(update_viewport_lods):
+        bpy.app.timers.unregister(update_viewport_lods)
+    bpy.app.handlers.render_cancel.remove(on_render_done)
+    bpy.app.handlers.render_complete.remove(on_render_done)
+    bpy.app.handlers.render_pre.remove(on_render_pre)
@@ -4,6 +4,10 @@ import random
 
 import bmesh
 import bpy
+import numpy as np
+
+from .handler import (FACE_GROUP_ATTRIBUTE, face_group_indices,
+                      reclaim_orphans)
 
 
 class SelectByFaceIDOperator(bpy.types.Operator):
@@ -37,27 +41,15 @@ class SelectByFaceIDOperator(bpy.types.Operator):
             self.report({'ERROR'}, "No face_ids found")
             return {'CANCELLED'}
 
+        group_index = get_face_group_indices(mesh, bm)
+
         # Collect group IDs of all selected faces
-        selected_group_ids = set()
-        for face in bm.faces:
-            if face.select:
-                loop_idx = face.loops[0].index
-                for i in range(0, len(groups), 2):
-                    group_start = groups[i + 0]
-                    group_count = groups[i + 1]
-                    if loop_idx >= group_start and loop_idx < group_start + group_count:
-                        selected_group_ids.add(i)
-                        break
+        selected_group_ids = get_selected_group_ids(group_index, bm)
 
         # Select all faces belonging to any of the selected group IDs
-        for face in bm.faces:
-            loop_start = face.loops[0].index
-            for group_id in selected_group_ids:
-                group_start = groups[group_id + 0]
-                group_count = groups[group_id + 1]
-                if loop_start >= group_start and loop_start < group_start + group_count:
-                    face.select = True
-                    break
+        bm.faces.ensure_lookup_table()
+        for face_index in faces_in_group_ids(group_index, selected_group_ids):
+            bm.faces[face_index].select = True
 
         bmesh.update_edit_mesh(mesh)
         return {'FINISHED'}
@@ -93,19 +85,15 @@ class SelectByFaceIDEdgeOperator(bpy.types.Operator):
             self.report({'ERROR'}, "No face_ids found")
             return {'CANCELLED'}
 
-        selected_group_ids = get_selected_group_ids(groups, bm)
+        group_index = get_face_group_indices(mesh, bm)
+        selected_group_ids = get_selected_group_ids(group_index, bm)
         boundary_edges = get_boundary_edges_for_group_ids(
-            groups, bm, selected_group_ids)
+            group_index, bm, selected_group_ids)
 
         # Unselect the faces in selected_group_ids
-        for face in bm.faces:
-            loop_start = face.loops[0].index
-            for group_id in selected_group_ids:
-                group_start = groups[group_id + 0]
-                group_count = groups[group_id + 1]
-                if loop_start >= group_start and loop_start < group_start + group_count:
-                    face.select = False
-                    break
+        bm.faces.ensure_lookup_table()
+        for face_index in faces_in_group_ids(group_index, selected_group_ids):
+            bm.faces[face_index].select = False
 
         # Select the boundary edges
         for edge in boundary_edges:
@@ -169,7 +157,8 @@ class AutoMarkEdgesOperator(bpy.types.Operator):
             mesh = obj.data
             bm = bmesh.from_edit_mesh(mesh)
             groups = mesh["groups"]
-            selected_group_ids = get_selected_group_ids(groups, bm)
+            selected_group_ids = get_selected_group_ids(
+                get_face_group_indices(mesh, bm), bm)
             if len(selected_group_ids) == 0:
                 bpy.ops.object.mode_set(mode='OBJECT')
                 self.mark_sharp_edges(obj, groups)
@@ -203,7 +192,7 @@ class AutoMarkEdgesOperator(bpy.types.Operator):
         bm = bmesh.from_edit_mesh(mesh)
 
         boundary_edges = get_boundary_edges_for_group_ids(
-            mesh["groups"], bm, selected_group_ids)
+            get_face_group_indices(mesh, bm), bm, selected_group_ids)
 
         for edge in boundary_edges:
             if self.mark_sharp:
@@ -288,35 +277,51 @@ def face_boundary_edges(groups, mesh, bm):
     return all_face_boundary_edges
 
 
-def get_boundary_edges_for_group_ids(groups, bm, selected_group_ids):
+def get_face_group_indices(mesh, bm=None):
+    """Per-polygon Plasticity group index, read from the attribute the handler writes at ingest.
+
+    Falls back to resolving the (start, count) pairs in mesh["groups"] for meshes imported before the attribute existed.
+    """
+    if bm is not None:
+        layer = bm.faces.layers.int.get(FACE_GROUP_ATTRIBUTE)
+        if layer is not None:
+            return np.fromiter((face[layer] for face in bm.faces), dtype=np.int32, count=len(bm.faces))
+        loop_start = np.fromiter(
+            (face.loops[0].index for face in bm.faces), dtype=np.int32, count=len(bm.faces))
+    else:
+        attribute = mesh.attributes.get(FACE_GROUP_ATTRIBUTE)
+        if attribute is not None and attribute.domain == 'FACE':
+            group_index = np.empty(len(mesh.polygons), dtype=np.int32)
+            attribute.data.foreach_get("value", group_index)
+            return group_index
+        loop_start = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", loop_start)
+    return face_group_indices(mesh["groups"], loop_start)
+
+
+def faces_in_group_ids(group_index, group_ids):
+    if len(group_ids) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.isin(group_index, list(group_ids)))
+
+
+def get_boundary_edges_for_group_ids(group_index, bm, selected_group_ids):
     boundary_edges = set()
-    for face in bm.faces:
-        loop_start = face.loops[0].index
-        for group_id in selected_group_ids:
-            group_start = groups[group_id + 0]
-            group_count = groups[group_id + 1]
-            if loop_start >= group_start and loop_start < group_start + group_count:
-                for edge in face.edges:
-                    if edge in boundary_edges:
-                        boundary_edges.remove(edge)
-                    else:
-                        boundary_edges.add(edge)
-                break
+    bm.faces.ensure_lookup_table()
+    for face_index in faces_in_group_ids(group_index, selected_group_ids):
+        for edge in bm.faces[face_index].edges:
+            if edge in boundary_edges:
+                boundary_edges.remove(edge)
+            else:
+                boundary_edges.add(edge)
     return boundary_edges
 
 
-def get_selected_group_ids(groups, bm):
-    selected_group_ids = set()
-    for face in bm.faces:
-        if face.select:
-            loop_idx = face.loops[0].index
-            for i in range(0, len(groups), 2):
-                group_start = groups[i + 0]
-                group_count = groups[i + 1]
-                if loop_idx >= group_start and loop_idx < group_start + group_count:
-                    selected_group_ids.add(i)
-                    break
-    return selected_group_ids
+def get_selected_group_ids(group_index, bm):
+    selected = np.fromiter(
+        (face.select for face in bm.faces), dtype=bool, count=len(bm.faces))
+    selected_group_ids = np.unique(group_index[selected])
+    return set(selected_group_ids[selected_group_ids >= 0].tolist())
 
 
 class PaintPlasticityFacesOperator(bpy.types.Operator):
@@ -349,6 +354,8 @@ class PaintPlasticityFacesOperator(bpy.types.Operator):
             self.colorize_mesh(obj, mesh)
 
             mat = bpy.data.materials.new(name="VertexColorMat")
+            # NOTE: lets the handler free this material together with the object's mesh
+            mat["plasticity_owned"] = True
             mat.use_nodes = True
             nodes = mat.node_tree.nodes
 
@@ -367,7 +374,10 @@ class PaintPlasticityFacesOperator(bpy.types.Operator):
                 material_output.inputs['Surface'], shader_node.outputs['BSDF'])
 
             if obj.data.materials:
+                previous = obj.data.materials[0]
                 obj.data.materials[0] = mat
+                if previous is not None and previous.get("plasticity_owned"):
+                    reclaim_orphans([previous])
             else:
                 obj.data.materials.append(mat)
 
@@ -388,22 +398,16 @@ class PaintPlasticityFacesOperator(bpy.types.Operator):
             mesh.vertex_colors.new()
         color_layer = mesh.vertex_colors.active
 
-        group_idx = 0
-        group_start = groups[group_idx * 2 + 0]
-        group_count = groups[group_idx * 2 + 1]
-        face_id = face_ids[group_idx]
-        color = generate_random_color(face_id)
-
-        for poly in mesh.polygons:
-            loop_start = poly.loop_start
-            if loop_start >= group_start + group_count:
-                group_idx += 1
-                group_start = groups[group_idx * 2 + 0]
-                group_count = groups[group_idx * 2 + 1]
-                face_id = face_ids[group_idx]
-                color = generate_random_color(face_id)
-            for loop_index in range(loop_start, loop_start + poly.loop_total):
-                color_layer.data[loop_index].color = color
+        group_index = get_face_group_indices(mesh)
+        group_colors = np.array([generate_random_color(face_id)
+                                for face_id in face_ids], dtype=np.float32)
+        polygon_colors = np.where(
+            (group_index >= 0)[:, None], group_colors[np.clip(group_index, 0, None)], 1.0)
+
+        loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+        loop_colors = np.repeat(polygon_colors, loop_total, axis=0)
+        color_layer.data.foreach_set("color", loop_colors.ravel())
 
 class NonOverlappingMeshesMerger(bpy.types.Operator):
     bl_idname = "object.merge_nonoverlapping_meshes"
@@ -0,0 +1,49 @@
+import bpy
+
+from .refacet import group_by_facet_params, plasticity_objects_by_filename
+
+POLL_INTERVAL = 0.5
+
+
+class RefacetPrefetcher:
+    """Watches the selection and prefetches refacets of the selected objects at the current facet settings.
+
+    Results only go into the client's refacet cache, so pressing Refacet afterwards applies them without a round trip.
+    Whatever hasn't been sent yet is dropped when the selection changes.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.selection = set()
+        self.timer = self.__on_timer
+
+    def register(self):
+        bpy.app.timers.register(self.timer, first_interval=POLL_INTERVAL, persistent=True)
+
+    def unregister(self):
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+
+    def __on_timer(self):
+        context = bpy.context
+        scene = context.scene
+        client = self.client
+        if scene is None or not scene.prop_plasticity_refacet_prefetch or not client.connected:
+            self.selection = set()
+            return POLL_INTERVAL
+
+        objects = [obj for obj in context.view_layer.objects.selected
+                   if obj.type == 'MESH' and "plasticity_id" in obj]
+        selection = set((obj.get("plasticity_filename"), obj["plasticity_id"]) for obj in objects)
+        if selection == self.selection:
+            return POLL_INTERVAL
+        self.selection = selection
+
+        client.cancel_prefetch()
+        for params, params_objects in group_by_facet_params(scene, objects).items():
+            for filename, file_objects in plasticity_objects_by_filename(params_objects).items():
+                client.prefetch_refacets(filename,
+                                         [obj["plasticity_id"] for obj in file_objects],
+                                         [obj.get("plasticity_version") for obj in file_objects],
+                                         params)
+        return POLL_INTERVAL
@@ -0,0 +1,119 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# NOTE: numpy releases the GIL for the heavy parts (fancy indexing, unique, diff), so this overlaps with the UI
+executor = ThreadPoolExecutor(max_workers=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                              thread_name_prefix="plasticity-prepare")
+
+# NOTE: everything the main thread needs to foreach_set a mesh, derived from the decoded buffers
+PreparedMesh = namedtuple("PreparedMesh", [
+    "vertices", "loop_vertex_index", "loop_start", "loop_total", "loop_normals", "face_group", "face_id"])
+
+
+def face_group_indices(groups, loop_start):
+    """Map every polygon, by its first loop, to the index of the (start, count) group containing it (-1 if none)."""
+    loop_start = np.asarray(loop_start, dtype=np.int32)
+    groups = np.asarray(groups, dtype=np.int32).reshape(-1, 2)
+    if len(groups) == 0:
+        return np.full(len(loop_start), -1, dtype=np.int32)
+
+    order = np.argsort(groups[:, 0], kind='stable')
+    starts = groups[order, 0]
+    ends = starts + groups[order, 1]
+
+    position = np.searchsorted(starts, loop_start, side='right') - 1
+    clipped = np.clip(position, 0, None)
+    valid = (position >= 0) & (loop_start < ends[clipped])
+    return np.where(valid, order[clipped], -1).astype(np.int32)
+
+
+def polygon_face_ids(group_index, face_ids):
+    face_ids = np.asarray(face_ids, dtype=np.int32)
+    if len(face_ids) == 0:
+        return np.full(len(group_index), -1, dtype=np.int32)
+    return np.where(group_index >= 0, face_ids[np.clip(group_index, 0, len(face_ids) - 1)], -1).astype(np.int32)
+
+
+def prepare_triangles(verts, indices, normals, groups, face_ids):
+    indices = np.asarray(indices, dtype=np.int32)
+    loop_start = np.arange(0, len(indices), 3, dtype=np.int32)
+    loop_total = np.full(len(loop_start), 3, dtype=np.int32)
+    loop_normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)[indices]
+    face_group = face_group_indices(groups, loop_start)
+
+    return PreparedMesh(np.asarray(verts, dtype=np.float32), indices, loop_start, loop_total, loop_normals,
+                        face_group, polygon_face_ids(face_group, face_ids))
+
+
+def prepare_ngons(faces, verts, indices, normals, groups, face_ids):
+    indices = np.asarray(indices, dtype=np.int32)
+
+    verts_array = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    unique_verts, inverse_indices = np.unique(
+        verts_array, axis=0, return_inverse=True)
+    new_indices = inverse_indices.reshape(-1)[indices].astype(np.int32)
+
+    if faces is None or len(faces) == 0:
+        loop_start = np.arange(0, len(new_indices), 3, dtype=np.int32)
+        loop_total = np.full(len(loop_start), 3, dtype=np.int32)
+    else:
+        # Find where a new face/polygon starts (value changes in the array)
+        diffs = np.where(np.diff(faces))[0] + 1
+        # Insert the starting index for the first polygon
+        loop_start = np.insert(diffs, 0, 0).astype(np.int32)
+        # Calculate the number of vertices per polygon
+        loop_total = np.append(np.diff(loop_start), [
+                               len(faces) - loop_start[-1]]).astype(np.int32)
+
+    loop_normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)[indices]
+    face_group = face_group_indices(groups, loop_start)
+
+    return PreparedMesh(unique_verts.ravel(), new_indices, loop_start, loop_total, loop_normals,
+                        face_group, polygon_face_ids(face_group, face_ids))
+
+
+def submit_triangles(verts, indices, normals, groups, face_ids):
+    return executor.submit(prepare_triangles, verts, indices, normals, groups, face_ids)
+
+
+def submit_ngons(faces, verts, indices, normals, groups, face_ids):
+    return executor.submit(prepare_ngons, faces, verts, indices, normals, groups, face_ids)
+
+
+def vertex_bounds(verts):
+    """(2, 3) min/max corners of a flat xyz vertex array."""
+    verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+    return np.stack([verts.min(axis=0), verts.max(axis=0)])
+
+
+def submit_bounds(items):
+    """Start computing the bounding box of every item with geometry; the future is stored on the item as "bounds"."""
+    for item in items:
+        if item["vertices"] is not None and len(item["vertices"]) > 0:
+            item["bounds"] = executor.submit(vertex_bounds, item["vertices"])
+
+
+def items_bounded(items):
+    return all(item.get("bounds") is None or item["bounds"].done() for item in items)
+
+
+def submit_items(items):
+    """Start preparing every mesh item of a decoded transaction; the future is stored on the item as "prepared"."""
+    for item in items:
+        if item["vertices"] is not None and item["faces"] is not None:
+            item["prepared"] = submit_triangles(
+                item["vertices"], item["faces"], item["normals"], item["groups"], item["face_ids"])
+
+
+def items_prepared(items):
+    return all(item.get("prepared") is None or item["prepared"].done() for item in items)
+
+
+def resolve(item):
+    prepared = item.get("prepared")
+    if prepared is not None:
+        return prepared.result()
+    return prepare_triangles(item["vertices"], item["faces"], item["normals"], item["groups"], item["face_ids"])
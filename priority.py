@@ -0,0 +1,63 @@
+import numpy as np
+
+from .lod import view_region_3d
+
+SELECTED = 0
+IN_VIEW = 1
+OTHER = 2
+
+# NOTE: indices into (min, max) for the 8 corners of a bounding box
+CORNERS = np.array([[(i >> axis) & 1 for axis in range(3)] for i in range(8)])
+
+
+def selected_ids(context, filename):
+    """Plasticity ids of the selected and active objects of filename."""
+    objects = list(context.selected_objects)
+    active = context.view_layer.objects.active
+    if active is not None:
+        objects.append(active)
+    return set(obj["plasticity_id"] for obj in objects
+               if "plasticity_id" in obj and obj.get("plasticity_filename") == filename)
+
+
+def in_frustum(bounds, matrix):
+    """Which of the (n, 2, 3) min/max boxes may be visible through the 4x4 perspective matrix."""
+    corners = bounds[:, CORNERS, np.arange(3)]
+    homogeneous = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=2)
+    clip = homogeneous @ matrix.T
+    w = clip[..., 3]
+    outside = np.zeros(len(bounds), dtype=bool)
+    for axis in range(3):
+        outside |= (clip[..., axis] < -w).all(axis=1)
+        outside |= (clip[..., axis] > w).all(axis=1)
+    return ~outside
+
+
+def prioritize(items, context, filename, unit_scale=1.0):
+    """Order items so that selected/active objects come first, then those in the viewport, then the rest.
+
+    The bounding boxes were computed from the incoming vertex arrays in the worker pool (see prepare.submit_bounds),
+    so this works for objects that don't exist yet. The sort is stable, so within a priority the order of the message
+    is kept.
+    """
+    if len(items) == 0:
+        return items
+
+    priorities = np.full(len(items), OTHER, dtype=np.int32)
+
+    region_3d = view_region_3d(context)
+    if region_3d is not None:
+        matrix = np.array(region_3d.perspective_matrix, dtype=np.float64)
+        with_geometry = [i for i, item in enumerate(items) if item.get("bounds") is not None]
+        if with_geometry:
+            bounds = np.array([items[i]["bounds"].result() for i in with_geometry], dtype=np.float64)
+            visible = in_frustum(bounds * unit_scale, matrix)
+            priorities[np.asarray(with_geometry)[visible]] = IN_VIEW
+
+    selected = selected_ids(context, filename)
+    if selected:
+        for i, item in enumerate(items):
+            if item["id"] in selected:
+                priorities[i] = SELECTED
+
+    return [items[i] for i in np.argsort(priorities, kind='stable')]
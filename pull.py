@@ -0,0 +1,96 @@
+import time
+
+import bpy
+
+PAUSED_POLL_INTERVAL = 0.5
+# NOTE: LIST_SOME_1 can only refresh objects Blender already has, so a file is listed in full at least this often to
+# pick up objects created (or deleted) in Plasticity since
+FULL_PULL_INTERVAL = 60.0
+
+
+class PullOnSave:
+    """Refreshes a file when Plasticity announces a new version of it, as a lighter alternative to the live link.
+
+    Announcements are coalesced per file and pulled at most once per min interval. The pull is a LIST_SOME_1 of the
+    announced file's objects that Blender has, tagged with their versions, so unchanged objects are neither prepared
+    nor rebuilt, and applied like an update, so nothing is deleted. A file that hasn't been listed in full for
+    FULL_PULL_INTERVAL (or ever, this connection) is listed in full instead, which also brings in new objects.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = set()
+        self.timer_registered = False
+        self.timer = self.__on_timer
+        self.last_pull = 0.0
+        self.pulls = 0
+        # NOTE: filename -> when it was last listed in full
+        self.full_pulls = {}
+
+    def on_new_version(self, filename, version):
+        scene = bpy.context.scene
+        if not scene.prop_plasticity_pull_on_save or self.client.subscribed:
+            return
+        self.pending.add(filename)
+        if not self.timer_registered:
+            self.timer_registered = True
+            bpy.app.timers.register(self.timer, first_interval=0.001, persistent=True)
+
+    def reset(self):
+        self.pending = set()
+        self.full_pulls = {}
+
+    def cancel(self):
+        self.reset()
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.timer_registered = False
+
+    def __on_timer(self):
+        scene = bpy.context.scene
+        client = self.client
+        if not self.pending or not client.connected or client.subscribed or not scene.prop_plasticity_pull_on_save:
+            self.pending = set()
+            self.timer_registered = False
+            return None
+
+        if scene.prop_plasticity_pull_paused:
+            # NOTE: keep what was announced meanwhile, it is pulled once unpaused
+            return PAUSED_POLL_INTERVAL
+
+        wait = self.last_pull + scene.prop_plasticity_pull_min_interval - time.monotonic()
+        if wait > 0:
+            return wait
+
+        filenames = self.pending
+        self.pending = set()
+        handler = client.handler
+        list_everything = False
+        now = time.monotonic()
+        for filename in filenames:
+            known_versions = handler.known_versions(filename)
+            # NOTE: the announcement doesn't say which objects changed, so every object of the file Blender knows
+            # about is stale; deferred items are refreshed too, so they don't materialize at an old version
+            plasticity_ids = [plasticity_id for _, plasticity_id in known_versions]
+            plasticity_ids += [plasticity_id for plasticity_id in handler.deferred.ids(filename)
+                               if (filename, plasticity_id) not in known_versions]
+            last_full_pull = self.full_pulls.get(filename)
+            if plasticity_ids and last_full_pull is not None and now - last_full_pull < FULL_PULL_INTERVAL:
+                client.list_some(filename, plasticity_ids, known_versions=known_versions)
+            else:
+                list_everything = True
+                self.full_pulls[filename] = now
+
+        if list_everything:
+            all_known_versions = {}
+            for filename in handler.files:
+                all_known_versions.update(handler.known_versions(filename))
+            if scene.prop_plasticity_list_only_visible:
+                client.list_visible(known_versions=all_known_versions)
+            else:
+                client.list_all(known_versions=all_known_versions)
+
+        self.pulls += 1
+        self.last_pull = time.monotonic()
+        self.timer_registered = False
+        return None
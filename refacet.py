@@ -0,0 +1,140 @@
+import math
+from collections import namedtuple
+
+from .client import FacetShapeType
+
+# NOTE: the keyword arguments of PlasticityClient.refacet_some, as one hashable value
+FacetParams = namedtuple("FacetParams", [
+    "relative_to_bbox", "curve_chord_tolerance", "curve_chord_angle", "surface_plane_tolerance", "surface_plane_angle",
+    "match_topology", "max_sides", "plane_angle", "min_width", "max_width", "curve_chord_max", "shape"])
+
+MIN_TOLERANCE = 0.0001
+MAX_TOLERANCE = 1.0
+MIN_ANGLE = 0.1
+MAX_ANGLE = 1.0
+# NOTE: how much coarser the preview of a progressive refacet is than the requested tessellation
+PREVIEW_COARSENING = 8.0
+
+
+# NOTE: ID property holding the key of the RefacetPreset assigned to an object or a collection
+PRESET_PROPERTY = "plasticity_refacet_preset"
+
+
+def facet_params_from_scene(scene):
+    """The facet parameters the Refacet button uses: the active preset if there is one, otherwise the scene settings."""
+    preset = None
+    if len(scene.refacet_presets) > 0:
+        preset = scene.refacet_presets[scene.active_refacet_preset_index]
+    return facet_params_from_preset(scene, preset)
+
+
+def assigned_preset(scene, obj):
+    """The preset assigned to obj, or else to one of the collections it is in; None if there is none (or it is gone)."""
+    key = obj.get(PRESET_PROPERTY)
+    if key is None:
+        for collection in obj.users_collection:
+            key = collection.get(PRESET_PROPERTY)
+            if key is not None:
+                break
+    if key is None:
+        return None
+    for preset in scene.refacet_presets:
+        if preset.key == key:
+            return preset
+    return None
+
+
+def facet_params_for_object(scene, obj):
+    preset = assigned_preset(scene, obj)
+    if preset is None:
+        return facet_params_from_scene(scene)
+    return facet_params_from_preset(scene, preset)
+
+
+def group_by_facet_params(scene, objects):
+    """Group objects by the facet parameters they resolve to, so that each group can go out in one request."""
+    groups = {}
+    for obj in objects:
+        groups.setdefault(facet_params_for_object(scene, obj), []).append(obj)
+    return groups
+
+
+def facet_params_from_preset(scene, preset):
+    """The facet parameters of preset, or of the scene settings when preset is None."""
+    if preset is not None:
+        curve_chord_tolerance = preset.tolerance
+        surface_plane_tolerance = preset.tolerance
+        curve_chord_angle = preset.angle
+        surface_plane_angle = preset.angle
+    else:
+        curve_chord_tolerance = scene.prop_plasticity_facet_tolerance
+        surface_plane_tolerance = scene.prop_plasticity_facet_tolerance
+        curve_chord_angle = scene.prop_plasticity_facet_angle
+        surface_plane_angle = scene.prop_plasticity_facet_angle
+
+    max_sides = 3 if scene.prop_plasticity_facet_tri_or_ngon == "TRI" else 128
+    plane_angle = math.pi / 4.0 if (max_sides > 4) else 0
+
+    min_width = 0
+    max_width = 0
+    curve_chord_max = 0
+
+    if scene.prop_plasticity_ui_show_advanced_facet:
+        if preset is not None:
+            surface_plane_tolerance = preset.Face_plane_tolerance
+            surface_plane_angle = preset.Face_Angle_tolerance
+            curve_chord_tolerance = preset.Edge_chord_tolerance
+            curve_chord_angle = preset.Edge_Angle_tolerance
+            min_width = preset.min_width
+            max_width = preset.max_width
+        else:
+            surface_plane_tolerance = scene.prop_plasticity_surface_plane_tolerance
+            surface_plane_angle = scene.prop_plasticity_surface_angle_tolerance
+            curve_chord_tolerance = scene.prop_plasticity_curve_chord_tolerance
+            curve_chord_angle = scene.prop_plasticity_curve_angle_tolerance
+            min_width = scene.prop_plasticity_facet_min_width
+            max_width = scene.prop_plasticity_facet_max_width
+        if max_width > 0 and max_width < min_width:
+            max_width = min_width
+
+        curve_chord_max = max_width * math.sqrt(0.5)
+
+    return FacetParams(relative_to_bbox=True,
+                       curve_chord_tolerance=curve_chord_tolerance,
+                       curve_chord_angle=curve_chord_angle,
+                       surface_plane_tolerance=surface_plane_tolerance,
+                       surface_plane_angle=surface_plane_angle,
+                       match_topology=True,
+                       max_sides=max_sides,
+                       plane_angle=plane_angle,
+                       min_width=min_width,
+                       max_width=max_width,
+                       curve_chord_max=curve_chord_max,
+                       shape=FacetShapeType.CUT)
+
+
+def coarsened(params, factor):
+    """The same parameters with chord/plane tolerances multiplied by factor (angles by its square root)."""
+    if factor == 1:
+        return params
+    angle_factor = math.sqrt(factor)
+
+    def tolerance(value):
+        return min(max(value * factor, MIN_TOLERANCE), MAX_TOLERANCE)
+
+    def angle(value):
+        return min(max(value * angle_factor, MIN_ANGLE), MAX_ANGLE)
+    return params._replace(
+        curve_chord_tolerance=tolerance(params.curve_chord_tolerance),
+        surface_plane_tolerance=tolerance(params.surface_plane_tolerance),
+        curve_chord_angle=angle(params.curve_chord_angle),
+        surface_plane_angle=angle(params.surface_plane_angle))
+
+
+def plasticity_objects_by_filename(objects):
+    objects_by_filename = {}
+    for obj in objects:
+        if "plasticity_filename" in obj.keys():
+            objects_by_filename.setdefault(
+                obj["plasticity_filename"], []).append(obj)
+    return objects_by_filename
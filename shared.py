@@ -0,0 +1,140 @@
+"""State shared by the addon's modules: the client and its helpers, and refacet preset persistence.
+
+Everything that needs these imports them from here, so that there is exactly one of each.
+"""
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import bpy
+from bpy.app.handlers import persistent
+
+from .budget import TriangleBudget
+from .client import PlasticityClient
+from .handler import SceneHandler
+from .live_refacet import LiveRefacet
+from .prefetch import RefacetPrefetcher
+
+# NOTE: bl_info["name"] with spaces replaced; bl_info lives in __init__.py, which this module must not import
+addon_name = "Plasticity"
+
+base_path = bpy.utils.script_path_user()
+presets_folder = os.path.join(base_path, 'presets', addon_name)
+
+if not os.path.exists(presets_folder):
+    os.makedirs(presets_folder)
+
+PRESET_FILE_PATH = os.path.join(presets_folder, 'refacet_presets.json')
+
+handler = SceneHandler()
+plasticity_client = PlasticityClient(handler)
+triangle_budget = TriangleBudget(plasticity_client)
+refacet_prefetcher = RefacetPrefetcher(plasticity_client)
+live_refacet = LiveRefacet(plasticity_client)
+
+# NOTE: the fields of a RefacetPreset that are written to and read from the presets file
+PRESET_FIELDS = ("key", "name", "tolerance", "angle", "min_width", "max_width", "Edge_chord_tolerance",
+                 "Edge_Angle_tolerance", "Face_plane_tolerance", "Face_Angle_tolerance")
+# NOTE: how long the presets must stay put before they are written, so a slider drag ends in a single write
+PRESET_SAVE_DELAY = 0.5
+
+preset_save_deadline = 0.0
+preset_save_timer_registered = False
+# NOTE: set while load_presets fills in the presets, whose update callbacks must then neither save nor refacet
+loading_presets = False
+
+# Save Refacet presets
+def save_presets():
+    scene = bpy.context.scene
+    if scene is None:
+        return
+    presets = [preset.to_dict() for preset in scene.refacet_presets]
+
+    # NOTE: write next to the presets file and swap it in, so a crash mid-write can't leave a truncated file
+    fd, temp_path = tempfile.mkstemp(dir=presets_folder, prefix='.refacet_presets', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(presets, f)
+        os.replace(temp_path, PRESET_FILE_PATH)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def schedule_save_presets():
+    global preset_save_deadline, preset_save_timer_registered
+    preset_save_deadline = time.monotonic() + PRESET_SAVE_DELAY
+    if not preset_save_timer_registered:
+        preset_save_timer_registered = True
+        bpy.app.timers.register(on_save_presets_timer, first_interval=PRESET_SAVE_DELAY, persistent=True)
+
+def on_save_presets_timer():
+    global preset_save_deadline, preset_save_timer_registered
+    if preset_save_deadline == 0.0:
+        preset_save_timer_registered = False
+        return None
+    wait = preset_save_deadline - time.monotonic()
+    if wait > 0:
+        return wait
+    preset_save_deadline = 0.0
+    preset_save_timer_registered = False
+    save_presets()
+    return None
+
+def flush_presets():
+    """Write a pending deferred save right away, e.g. before the addon goes away."""
+    global preset_save_deadline, preset_save_timer_registered
+    if bpy.app.timers.is_registered(on_save_presets_timer):
+        bpy.app.timers.unregister(on_save_presets_timer)
+    preset_save_timer_registered = False
+    if preset_save_deadline != 0.0:
+        preset_save_deadline = 0.0
+        save_presets()
+
+# Load refacet presets
+@persistent
+def load_presets(dummy):
+    global loading_presets
+    scene = bpy.context.scene
+
+    # Clear existing presets
+    scene.refacet_presets.clear()
+    
+    if scene is None or not os.path.exists(PRESET_FILE_PATH):        
+        return
+    with open(PRESET_FILE_PATH, 'r') as f:
+        presets = json.load(f)    
+    
+    missing_keys = False
+    loading_presets = True
+    try:
+        for preset_dict in presets:
+            preset = scene.refacet_presets.add()
+            preset.from_dict(preset_dict)            
+            if not preset.key:
+                preset.key = uuid.uuid4().hex
+                missing_keys = True
+    finally:
+        loading_presets = False
+    if missing_keys:
+        schedule_save_presets()
+
+# The datablocks indexed for a list reply don't survive undo, redo or loading a .blend
+@persistent
+def forget_list_index(dummy):
+    handler.forget_list_index()
+
+def update_and_save_preset(self, context):
+    if loading_presets:
+        return
+    schedule_save_presets()
+    live_refacet.schedule(context)
+
+def update_facet_setting(self, context):
+    live_refacet.schedule(context)
+    
+def update_name(self, context):
+    if loading_presets:
+        return
+    schedule_save_presets()
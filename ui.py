@@ -1,9 +1,12 @@
 import bpy
-import math
 
-from .__init__ import plasticity_client
-from .__init__ import load_presets
-from .client import FacetShapeType
+from .shared import handler
+from .shared import plasticity_client
+from .shared import load_presets
+from .shared import triangle_budget
+from .lod import LOD_COARSENING
+from .refacet import (PRESET_PROPERTY, PREVIEW_COARSENING, assigned_preset, coarsened,
+                      group_by_facet_params, plasticity_objects_by_filename)
 
 
 
@@ -85,6 +88,28 @@ class UnsubscribeAllButton(bpy.types.Operator):
         plasticity_client.unsubscribe_all()
         return {'FINISHED'}
 
+class UndoCheckpointButton(bpy.types.Operator):
+    bl_idname = "wm.plasticity_undo_checkpoint"
+    bl_label = "Checkpoint"
+    bl_description = "Record an undo step for the live-link updates received so far"
+
+    def execute(self, context):
+        handler.undo.checkpoint()
+        return {'FINISHED'}
+
+class LoadHiddenButton(bpy.types.Operator):
+    bl_idname = "wm.plasticity_load_hidden"
+    bl_label = "Load Hidden"
+    bl_description = "Build the meshes of hidden objects whose import was deferred"
+
+    @classmethod
+    def poll(cls, context):
+        return len(handler.deferred) > 0
+
+    def execute(self, context):
+        handler.materialize_deferred()
+        return {'FINISHED'}
+
 class RefacetButton(bpy.types.Operator):
     bl_idname = "wm.refacet"
     bl_label = "Refacet"
@@ -97,73 +122,98 @@ class RefacetButton(bpy.types.Operator):
         return any("plasticity_id" in obj.keys() for obj in context.selected_objects)
 
     def execute(self, context):
-        if len(context.scene.refacet_presets) > 0:       
-            preset = context.scene.refacet_presets[context.scene.active_refacet_preset_index]
-            
-            curve_chord_tolerance = preset.tolerance
-            surface_plane_tolerance = preset.tolerance
-            curve_chord_angle = preset.angle
-            surface_plane_angle = preset.angle                                    
-        else:
-            curve_chord_tolerance = context.scene.prop_plasticity_facet_tolerance
-            surface_plane_tolerance = context.scene.prop_plasticity_facet_tolerance
-            curve_chord_angle = context.scene.prop_plasticity_facet_angle
-            surface_plane_angle = context.scene.prop_plasticity_facet_angle
-
-        max_sides = 3 if context.scene.prop_plasticity_facet_tri_or_ngon == "TRI" else 128
-        plane_angle = math.pi / 4.0 if (max_sides > 4) else 0
-
-        min_width = 0
-        max_width = 0
-        curve_chord_max = 0
-
-        if context.scene.prop_plasticity_ui_show_advanced_facet:            
-            if len(context.scene.refacet_presets) > 0: 
-                surface_plane_tolerance = preset.Face_plane_tolerance
-                surface_plane_angle = preset.Face_Angle_tolerance
-                curve_chord_tolerance = preset.Edge_chord_tolerance
-                curve_chord_angle = preset.Edge_Angle_tolerance
-                min_width = preset.min_width
-                max_width = preset.max_width            
+        refacet_objects(context.scene, context.selected_objects)
+        return {'FINISHED'}
+
+class RefacetAllButton(bpy.types.Operator):
+    bl_idname = "wm.plasticity_refacet_all"
+    bl_label = "Refacet All"
+    bl_description = "Refacet every Plasticity mesh in the scene, each with its assigned preset"
+
+    @classmethod
+    def poll(cls, context):
+        return plasticity_client.connected
+
+    def execute(self, context):
+        refacet_objects(context.scene, context.scene.objects)
+        return {'FINISHED'}
+
+class AssignRefacetPresetButton(bpy.types.Operator):
+    bl_idname = "wm.plasticity_assign_refacet_preset"
+    bl_label = "Assign Preset"
+    bl_description = "Assign the active refacet preset to the selected objects (or the active collection)"
+
+    clear: bpy.props.BoolProperty(name="Clear", default=False)
+
+    @classmethod
+    def poll(cls, context):
+        return len(context.scene.refacet_presets) > 0
+
+    def execute(self, context):
+        scene = context.scene
+        preset = scene.refacet_presets[scene.active_refacet_preset_index]
+        if not self.clear and not preset.key:
+            self.report({'WARNING'}, "Preset has no key yet; reconnect to reload the presets")
+            return {'CANCELLED'}
+        targets = list(context.selected_objects)
+        if len(targets) == 0:
+            targets = [context.collection]
+        for target in targets:
+            if self.clear:
+                if PRESET_PROPERTY in target:
+                    del target[PRESET_PROPERTY]
             else:
-                surface_plane_tolerance = context.scene.prop_plasticity_surface_plane_tolerance
-                surface_plane_angle = context.scene.prop_plasticity_surface_angle_tolerance
-                curve_chord_tolerance = context.scene.prop_plasticity_curve_chord_tolerance            
-                curve_chord_angle = context.scene.prop_plasticity_curve_angle_tolerance                
-                min_width = context.scene.prop_plasticity_facet_min_width
-                max_width = context.scene.prop_plasticity_facet_max_width
-            if max_width > 0 and max_width < min_width:
-                max_width = min_width
-                
-            curve_chord_max = max_width * math.sqrt(0.5)
-
-        plasticity_ids_by_filename = {}
-        
-        for obj in context.selected_objects:
-            if "plasticity_filename" in obj.keys():
-                if obj["plasticity_filename"] not in plasticity_ids_by_filename.keys():
-                    plasticity_ids_by_filename[obj["plasticity_filename"]] = []
-                plasticity_ids_by_filename[obj["plasticity_filename"]].append(
-                    obj["plasticity_id"])
-
-        for filename, plasticity_ids in plasticity_ids_by_filename.items():
-            plasticity_client.refacet_some(filename,
-                                           plasticity_ids,
-                                           relative_to_bbox=True,
-                                           curve_chord_tolerance=curve_chord_tolerance,
-                                           curve_chord_angle=curve_chord_angle,
-                                           surface_plane_tolerance=surface_plane_tolerance,
-                                           surface_plane_angle=surface_plane_angle,
-                                           match_topology=True,
-                                           max_sides=max_sides,
-                                           plane_angle=plane_angle,
-                                           min_width=min_width,
-                                           max_width=max_width,
-                                           curve_chord_max=curve_chord_max,
-                                           shape=FacetShapeType.CUT)
+                target[PRESET_PROPERTY] = preset.key
+        return {'FINISHED'}
+
+def refacet_objects(scene, objects):
+    """Refacet objects, sending one request per file and set of facet parameters (i.e. per assigned preset)."""
+    levels = scene.prop_plasticity_lod_levels if scene.prop_plasticity_lod_mode else 1
+    plasticity_client.refacet_cache.resize(
+        scene.prop_plasticity_refacet_cache_size * 2 ** 20)
+
+    objects = [obj for obj in objects if obj.type == 'MESH' and "plasticity_id" in obj]
+    for params, params_objects in group_by_facet_params(scene, objects).items():
+        for filename, file_objects in plasticity_objects_by_filename(params_objects).items():
+            plasticity_ids = [obj["plasticity_id"] for obj in file_objects]
+            versions = [obj.get("plasticity_version") for obj in file_objects]
+            if levels == 1:
+                preview = coarsened(params, PREVIEW_COARSENING) if scene.prop_plasticity_refacet_progressive else None
+                plasticity_client.refacet_some(filename,
+                                               plasticity_ids,
+                                               **params._asdict(),
+                                               versions=versions,
+                                               preview=preview)
+                continue
+            # NOTE: coarsest first, so the viewport level arrives before the render level
+            for level in reversed(range(levels)):
+                plasticity_client.refacet_some(filename,
+                                               plasticity_ids,
+                                               **coarsened(params, LOD_COARSENING ** level)._asdict(),
+                                               lod=level,
+                                               versions=versions)
+
+class RefacetToBudgetButton(bpy.types.Operator):
+    bl_idname = "wm.plasticity_refacet_budget"
+    bl_label = "Refacet to Budget"
+    bl_description = "Refacet the selected objects (or the active collection) to fit the triangle budget"
+
+    @classmethod
+    def poll(cls, context):
+        return plasticity_client.connected
 
+    def execute(self, context):
+        scene = context.scene
+        objects = context.selected_objects
+        if len(objects) == 0:
+            objects = context.collection.all_objects
+        if not triangle_budget.start(context, objects, scene.prop_plasticity_triangle_budget,
+                                     scene.prop_plasticity_budget_tolerance):
+            self.report({'WARNING'}, "No Plasticity meshes to refacet")
+            return {'CANCELLED'}
         return {'FINISHED'}
 
+
 class PlasticityPanel(bpy.types.Panel):
     bl_idname = "OBJECT_PT_plasticity_panel"
     bl_label = "Plasticity"
@@ -186,8 +236,14 @@ class PlasticityPanel(bpy.types.Panel):
             box.prop(scene, "prop_plasticity_server", text="Server")
 
         if plasticity_client.connected:
-            if plasticity_client.filename:
-                layout.label(text="Filename: " + plasticity_client.filename)
+            governor = plasticity_client.governor
+            for filename in plasticity_client.filenames:
+                metrics = governor.metrics.get(filename)
+                if metrics is None:
+                    layout.label(text="Filename: " + filename)
+                    continue
+                layout.label(text="{}: {} queued, {} applied, {:.0f} ms/apply".format(
+                    filename, governor.pending(filename), metrics.applies, metrics.apply_cost * 1000))
 
             layout.separator()
 
@@ -195,8 +251,22 @@ class PlasticityPanel(bpy.types.Panel):
             box.prop(scene, "prop_plasticity_list_only_visible",
                      text="Only visible")
             box.operator("wm.list", text="Refresh")
+            row = box.row(align=True)
+            row.prop(scene, "prop_plasticity_pull_on_save", text="Pull on save")
+            sub = row.row(align=True)
+            sub.active = scene.prop_plasticity_pull_on_save and not plasticity_client.subscribed
+            sub.prop(scene, "prop_plasticity_pull_paused", text="Pause", toggle=True)
+            sub.prop(scene, "prop_plasticity_pull_min_interval", text="Min")
             box.prop(scene, "prop_plasticity_unit_scale",
                      text="Scale", slider=True)
+            row = box.row(align=True)
+            row.prop(scene, "prop_plasticity_defer_hidden", text="Defer hidden")
+            sub = row.row(align=True)
+            sub.active = scene.prop_plasticity_defer_hidden
+            sub.prop(scene, "prop_plasticity_defer_to_disk", text="On disk")
+            if len(handler.deferred) > 0:
+                box.operator("wm.plasticity_load_hidden",
+                             text="Load {} hidden".format(len(handler.deferred)))
 
             layout.separator()
             
@@ -204,10 +274,40 @@ class PlasticityPanel(bpy.types.Panel):
                 layout.operator("wm.subscribe_all", text="Live link")
             else:
                 layout.operator("wm.unsubscribe_all", text="Disable live link")
+
+            row = layout.row(align=True)
+            row.prop(scene, "prop_plasticity_livelink_throttle", text="Throttle")
+            sub = row.row(align=True)
+            sub.active = scene.prop_plasticity_livelink_throttle
+            sub.prop(scene, "prop_plasticity_livelink_max_rate", text="Max/s")
+            if plasticity_client.subscribed:
+                layout.label(text="Live link: {:.1f} updates/s, {:.0f} ms/update".format(
+                    governor.effective_rate, governor.apply_cost * 1000))
+            if handler.metadata_writes or handler.metadata_skipped:
+                layout.label(text="Metadata: {} written, {} unchanged".format(
+                    handler.metadata_writes, handler.metadata_skipped))
+            if handler.reclaimed:
+                layout.label(text="Freed {} unused meshes and materials".format(handler.reclaimed))
+
+            box = layout.box()
+            box.prop(scene, "prop_plasticity_undo_policy", text="Undo")
+            if scene.prop_plasticity_undo_policy == "WINDOW":
+                box.prop(scene, "prop_plasticity_undo_window", text="Window")
+            elif scene.prop_plasticity_undo_policy == "NONE":
+                box.operator("wm.plasticity_undo_checkpoint", text="Checkpoint")
             layout.separator()
 
             box = layout.box()
-            refacet_op = box.operator("wm.refacet", text="Refacet")                      
+            row = box.row(align=True)
+            row.operator("wm.refacet", text="Refacet")
+            row.operator("wm.plasticity_refacet_all", text="Refacet All")
+            refacet_cache = plasticity_client.refacet_cache
+            row = box.row()
+            row.prop(scene, "prop_plasticity_refacet_cache_size", text="Cache (MB)")
+            row.label(text="{} cached, {:.0f} MB".format(
+                len(refacet_cache), refacet_cache.nbytes / 2 ** 20))
+            if plasticity_client.refacet_superseded > 0:
+                box.label(text="{} stale refacets dropped".format(plasticity_client.refacet_superseded))
             box.label(text="Refacet Presets")
             
             row = box.row()
@@ -216,9 +316,33 @@ class PlasticityPanel(bpy.types.Panel):
             col = row.column(align=True)
             col.operator("refacet_preset.add", icon='ADD', text="")
             col.operator("refacet_preset.remove", icon='REMOVE', text="")
+
+            row = box.row(align=True)
+            row.operator("wm.plasticity_assign_refacet_preset", text="Assign")
+            row.operator("wm.plasticity_assign_refacet_preset", text="Clear").clear = True
+            obj = context.active_object
+            if obj is not None and "plasticity_id" in obj:
+                assigned = assigned_preset(scene, obj)
+                box.label(text="{}: {}".format(obj.name, assigned.name if assigned is not None else "active preset"))
             
             box.prop(context.scene, "prop_plasticity_ui_show_advanced_facet", icon="TRIA_DOWN" if context.scene.prop_plasticity_ui_show_advanced_facet else "TRIA_RIGHT")
             box.prop(scene, "prop_plasticity_facet_tri_or_ngon", text="Tri or Ngon", expand=True)     
+            row = box.row(align=True)
+            row.prop(scene, "prop_plasticity_refacet_progressive", text="Progressive")
+            row.prop(scene, "prop_plasticity_refacet_prefetch", text="Prefetch")
+            row.prop(scene, "prop_plasticity_live_refacet", text="Live")
+            row = box.row(align=True)
+            row.operator("wm.plasticity_refacet_budget", text="Budget")
+            row.prop(scene, "prop_plasticity_triangle_budget", text="Tris")
+            row.prop(scene, "prop_plasticity_budget_tolerance", text="±")
+            if triangle_budget.status:
+                box.label(text=triangle_budget.status)
+            row = box.row(align=True)
+            row.prop(scene, "prop_plasticity_lod_mode", text="LOD")
+            sub = row.row(align=True)
+            sub.active = scene.prop_plasticity_lod_mode
+            sub.prop(scene, "prop_plasticity_lod_levels", text="Levels")
+            sub.prop(scene, "prop_plasticity_lod_distance", text="Distance")
             
             if len(context.scene.refacet_presets) > 0:
                 preset = context.scene.refacet_presets[context.scene.active_refacet_preset_index]                
@@ -0,0 +1,81 @@
+import time
+from enum import Enum
+
+import bpy
+
+
+class UndoPolicy(Enum):
+    TRANSACTION = "TRANSACTION"
+    WINDOW = "WINDOW"
+    NONE = "NONE"
+
+
+class UndoCoalescer:
+    """Turns live-link updates into undo steps according to the scene's undo policy.
+
+    Every bpy.ops.ed.undo_push snapshots global undo memory, so pushes are collapsed: at most one per
+    transaction, at most one per time window while a stream is active, or none until an explicit checkpoint.
+    """
+
+    def __init__(self):
+        self.pending_message = None
+        self.first_pending = None
+        self.last_change = None
+        self.timer_registered = False
+        # NOTE: a bound method is a new object on every access, so keep the one that is registered
+        self.timer = self.__on_timer
+
+    def push(self, message):
+        scene = bpy.context.scene
+        policy = UndoPolicy(scene.prop_plasticity_undo_policy)
+
+        if policy == UndoPolicy.NONE:
+            return
+
+        if policy == UndoPolicy.TRANSACTION:
+            self.pending_message = None
+            self.first_pending = None
+            bpy.ops.ed.undo_push(message=message)
+            return
+
+        now = time.monotonic()
+        if self.pending_message is None:
+            self.first_pending = now
+        self.pending_message = message
+        self.last_change = now
+        if not self.timer_registered:
+            self.timer_registered = True
+            bpy.app.timers.register(
+                self.timer, first_interval=scene.prop_plasticity_undo_window, persistent=True)
+
+    def checkpoint(self, message="Plasticity checkpoint"):
+        self.pending_message = None
+        self.first_pending = None
+        bpy.ops.ed.undo_push(message=message)
+
+    def cancel(self):
+        self.pending_message = None
+        self.first_pending = None
+        if bpy.app.timers.is_registered(self.timer):
+            bpy.app.timers.unregister(self.timer)
+        self.timer_registered = False
+
+    def __on_timer(self):
+        if self.pending_message is None:
+            self.timer_registered = False
+            return None
+
+        window = bpy.context.scene.prop_plasticity_undo_window
+        now = time.monotonic()
+        # NOTE: wait for the stream to go quiet, but never hold a step back for more than two windows
+        quiet_for = now - self.last_change
+        pending_for = now - self.first_pending
+        if quiet_for < window and pending_for < 2 * window:
+            return min(window - quiet_for, 2 * window - pending_for)
+
+        message = self.pending_message
+        self.pending_message = None
+        self.first_pending = None
+        self.timer_registered = False
+        bpy.ops.ed.undo_push(message=message)
+        return None